@@ -0,0 +1,161 @@
+"""
+Benchmarks of crawling, parsing and downloading, against a local `MockTwitter`.
+
+    python benchmark.py --output ./benchmark.json
+
+Results are appended to the output file as one line of JSON per run, so runs could be compared over time.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from twitterspider.decoder import Decoder
+from twitterspider.mock import MockTwitter, USER_BASE
+from twitterspider.pool import DownloadPool
+from twitterspider.tweet import Tweet
+from twitterspider.twitter import TwitterSpider, TwitterDownloader
+
+
+def peak_rss():
+    """
+    :return: peak resident set size of the process in MB
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+def bench_crawl(mock: MockTwitter, logger):
+    results = {}
+    crawls = {
+        'crawl_timeline': lambda spider: spider.crawl_timeline(user_id=USER_BASE),
+        'crawl_likes': lambda spider: spider.crawl_likes(user_id=USER_BASE),
+        'crawl_following': lambda spider: spider.crawl_following(user_id=USER_BASE),
+    }
+    for name, crawl in crawls.items():
+        spider = TwitterSpider('benchmark', logger=logger)
+        spider.base_url = mock.api_url
+        requests = mock.count()
+        start = time.perf_counter()
+        count = sum(1 for _ in crawl(spider))
+        elapsed = time.perf_counter() - start
+        results[name] = {'tweets': count, 'requests': mock.count() - requests, 'seconds': elapsed,
+                         'tweets_per_second': count / elapsed}
+    return results
+
+
+def bench_parse(mock: MockTwitter, pages: int):
+    spider = TwitterSpider('benchmark', logger=logging.getLogger('benchmark'))
+    spider.base_url = mock.api_url
+    page = json.dumps(spider.timeline(user_id=USER_BASE, count=200)).encode()
+    results = {'page_tweets': len(json.loads(page)), 'page_bytes': len(page)}
+    for backend in ('json', 'orjson'):
+        try:
+            decoder = Decoder(backend)
+        except ImportError:
+            continue
+        start = time.perf_counter()
+        for _ in range(pages):
+            decoder.decode(page)
+        decode = (time.perf_counter() - start) / pages
+        tweets = decoder.decode(page)
+        start = time.perf_counter()
+        for _ in range(pages):
+            for tweet in tweets:
+                Tweet(tweet)
+        construct = (time.perf_counter() - start) / pages
+        start = time.perf_counter()
+        for _ in range(pages):
+            for tweet in tweets:
+                tweet = Tweet(tweet)
+                for medium in tweet.source.media:
+                    medium.file_name
+        access = (time.perf_counter() - start) / pages
+        results[backend] = {'decode_ms': decode * 1000, 'construct_ms': construct * 1000,
+                            'construct_and_access_ms': access * 1000}
+    return results
+
+
+def bench_download(mock: MockTwitter, tweets: int, levels: list, logger):
+    spider = TwitterSpider('benchmark', logger=logger)
+    spider.base_url = mock.api_url
+    timeline = [tweet for tweet in spider.crawl_timeline(user_id=USER_BASE)][:tweets]
+    results = {}
+    for workers in levels:
+        folder = tempfile.mkdtemp(prefix='twitter-benchmark-')
+        try:
+            downloader = TwitterDownloader(folder, logger=logger)
+            pool = DownloadPool(downloader, workers=workers, per_host=workers)
+            start = time.perf_counter()
+            failed = sum(1 for _, error in pool.download(timeline, source=True) if error is not None)
+            elapsed = time.perf_counter() - start
+            files, size = 0, 0
+            for root, _, names in os.walk(folder):
+                for name in names:
+                    files += 1
+                    size += os.path.getsize(os.path.join(root, name))
+            results[str(workers)] = {'files': files, 'megabytes': size / 1024 / 1024, 'failed': failed,
+                                     'seconds': elapsed, 'files_per_second': files / elapsed,
+                                     'megabytes_per_second': size / 1024 / 1024 / elapsed}
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark crawling, parsing and downloading.')
+    parser.add_argument('--output', default='./benchmark.json', help='file to append the results to')
+    parser.add_argument('--only', nargs='*', choices=['crawl', 'parse', 'download'],
+                        default=['crawl', 'parse', 'download'], help='benchmarks to run')
+    parser.add_argument('--users', type=int, default=10, help='count of synthetic users')
+    parser.add_argument('--tweets', type=int, default=1000, help='count of tweets of every user')
+    parser.add_argument('--latency', type=float, default=0.005, help='latency of the local server in seconds')
+    parser.add_argument('--pages', type=int, default=50, help='count of pages to parse')
+    parser.add_argument('--downloads', type=int, default=300, help='count of tweets to download')
+    parser.add_argument('--workers', type=int, nargs='*', default=[1, 2, 4, 8, 16],
+                        help='concurrency levels of downloading')
+    parser.add_argument('--media-size', type=int, default=256 * 1024, help='size of images in bytes')
+    parser.add_argument('--video-size', type=int, default=2 * 1024 * 1024, help='size of videos in bytes')
+    args = parser.parse_args()
+
+    logger = logging.getLogger('benchmark')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    result = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'revision': revision(),
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'config': vars(args)}
+    # No rate limit, measure the throughput of the code itself
+    with MockTwitter(users=args.users, tweets=args.tweets, latency=args.latency, limits={},
+                     media_size=args.media_size, video_size=args.video_size) as mock:
+        if 'crawl' in args.only:
+            result['crawl'] = bench_crawl(mock, logger)
+        if 'parse' in args.only:
+            result['parse'] = bench_parse(mock, args.pages)
+        if 'download' in args.only:
+            result['download'] = bench_download(mock, args.downloads, args.workers, logger)
+    result['peak_rss_mb'] = peak_rss()
+
+    with open(args.output, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(result) + '\n')
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,17 @@
-from time import sleep
-
 from spiderutil.log import Log
 from spiderutil.connector import MongoDB
-from spiderutil.exceptions import SpiderException
 from spiderutil.path import StoreByUserName
 
 from twitterspider.twitter import TwitterSpider, TwitterDownloader
+from twitterspider.pipeline import Pipeline
 from twitterspider.util import TokenReader
-from twitterspider.tweet import Tweet
-from twitterspider.checkpoint import Checkpoint
+from twitterspider.checkpoint import CheckpointWriter
+from twitterspider.sink import JSONLinesSink
 
 if __name__ == '__main__':
-    # First, get a developer api token from local file.
-    token = TokenReader.from_local_file('./token')
+    # First, get developer api tokens from local file, one token per line.
+    # Requests are rotated across the tokens, each token has its own rate limit.
+    token = TokenReader.pool_from_local_file('./token')
 
     # If you need to use proxy, define it
     proxies = {
@@ -24,49 +23,39 @@ if __name__ == '__main__':
     spider = TwitterSpider(token, proxies=proxies)
 
     # Init a downloader to download tweet images and videos
+    # Media recorded in the manifest are skipped without downloading again
     downloader = TwitterDownloader(StoreByUserName('./download'),
-                                   proxies=proxies)
+                                   proxies=proxies, manifest='./manifest.db')
 
     # Init a logger if you want to print logs in the main function
     logger = Log.create_logger('TwitterSpider', './twitter.log')
 
     # Init the mongoDB to persist data,
+    # tweets are staged here until their media are downloaded
     mongo = MongoDB('Twitter')
-    # Check the connection and drop data in former session
+    # Check the connection, tweets left by the former session are resumed
     mongo.check_connection()
-    mongo.drop()
 
     # Save failed tweets into another collection
     failed = MongoDB('Twitter-Failed')
 
-    # Use local file to save checkpoint
-    checkpoint = Checkpoint.load_file('./checkpoint.txt')
-    since_id = checkpoint.tweet_id
-
-    # Crawl the timeline and save to mongoDB
-    # `screen_name` is the nickname of a user
-    for tweet in spider.crawl_timeline(screen_name='twitter', since_id=since_id):
-        # If you don't have mongoDB, you can use `downloader.download` download it directly
-        mongo.insert(tweet.dict)
+    # Keep the downloaded tweets in a compressed file, written in batches
+    # `MongoSink` and `SQLiteSink` are also available
+    sink = JSONLinesSink('./tweets.jsonl.gz')
 
-    # Download all the tweets
-    for data in mongo.all():
-        tweet = Tweet(data)
-        logger.info(tweet.id)
-
-        # Download the media
-        try:
-            downloader.download(tweet.source)
-        except SpiderException as e:
-            logger.error('Cannot download %s: %s', tweet.id, e)
-            # If failed to download the tweet, log it in another collection for future
-            failed.insert(tweet.dict)
-        finally:
-            mongo.remove({'id': tweet.id})
+    # Use local file to save checkpoint
+    # Updates are appended to a journal and compacted into the file every 1000 updates or 60 seconds
+    checkpoint = CheckpointWriter('./checkpoint.txt', every=1000, interval=60)
+    since_id = checkpoint.checkpoint.tweet_id
 
-        # Save the checkpoint
-        checkpoint.update(tweet_id=tweet.id)
-        checkpoint.save('./checkpoint.txt')
+    # Crawl the timeline and download the media at the same time
+    # `workers` limits the concurrent downloads, `per_host` limits them on the same host
+    # `queue_size` limits the tweets crawled but not downloaded yet
+    pipeline = Pipeline(downloader, staging=mongo, failed=failed, checkpoint=checkpoint,
+                        workers=8, per_host=4, queue_size=1000, batch_size=100, sink=sink)
 
-        # Since downloader has no delays, you need to add delay manually
-        sleep(2)
+    # `screen_name` is the nickname of a user
+    # If you don't have mongoDB, you can use `downloader.download` download it directly
+    with checkpoint, sink:
+        count = pipeline.run(spider.crawl_timeline(screen_name='twitter', since_id=since_id), resume=True)
+    logger.info('Finished %d tweets.', count)
@@ -0,0 +1,40 @@
+import threading
+import unittest
+from time import time
+
+from twitterspider.ratelimit import RateLimiter
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_exhausted_bucket_blocks_every_caller(self):
+        limiter = RateLimiter(margin=0)
+        reset = time() + 600
+        limiter.update('statuses/user_timeline', {'x-rate-limit-remaining': '0', 'x-rate-limit-reset': str(reset)})
+        delays = []
+        lock = threading.Lock()
+
+        def reserve():
+            delay = limiter.reserve('statuses/user_timeline')
+            with lock:
+                delays.append(delay)
+
+        threads = [threading.Thread(target=reserve) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(delays), 8)
+        for delay in delays:
+            self.assertGreater(delay, 590)
+
+    def test_quota_is_cleared_after_reset(self):
+        limiter = RateLimiter(margin=0)
+        limiter.update('statuses/user_timeline', {'x-rate-limit-remaining': '0', 'x-rate-limit-reset': str(time() - 1)})
+        self.assertEqual(limiter.reserve('statuses/user_timeline'), 0.0)
+        self.assertEqual(limiter.reserve('statuses/user_timeline'), 0.0)
+        self.assertIsNone(limiter.remaining('statuses/user_timeline'))
+
+
+if __name__ == '__main__':
+    unittest.main()
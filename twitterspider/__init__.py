@@ -1,4 +1,20 @@
+from .archive import *
+from .asynchronous import *
 from .checkpoint import *
+from .decoder import *
+from .logger import *
+from .manifest import *
+from .metrics import *
+from .mock import *
+from .pipeline import *
+from .pool import *
+from .ratelimit import *
+from .scheduler import *
+from .seen import *
+from .sink import *
+from .store import *
+from .sync import *
 from .tweet import *
 from .twitter import *
 from .util import *
+from .workqueue import *
@@ -0,0 +1,231 @@
+import json
+import os
+import sqlite3
+import struct
+import zlib
+from typing import Iterable
+
+from .decoder import Decoder
+from .sink import Sink
+from .tweet import Tweet
+
+BLOCK_SIZE = 256
+SEGMENT_SIZE = 64 * 1024 * 1024
+LEVEL = 6
+
+# Tweets nested in a tweet, their users are deduplicated too
+NESTED = ('retweeted_status', 'quoted_status')
+# Length of the compressed block before every block
+HEADER = struct.Struct('<I')
+# Users looked up in one query, below the limit of variables of SQLite
+USER_BATCH = 500
+USER_CACHE = 10000
+
+
+class TweetArchive(Sink):
+    """
+    Append-only archive of tweets, stored in a folder:
+    `segment-000001.dat` ... are blocks of tweets, every block is a zlib-compressed json array;
+    `index.db` is a SQLite index from tweet id to the block and the position in the block,
+    and the table of users, the user object in every tweet is replaced by the user id.
+
+        with TweetArchive('./archive') as archive:
+            for tweet in archive.tap(spider.crawl_timeline(screen_name='twitter')):
+                ...
+        for tweet in TweetArchive('./archive'):
+            downloader.download(tweet)
+
+    The latest user object written is kept for every user.
+    A tweet written again replaces the former one, which is skipped in reading.
+    """
+
+    def __init__(self, path: str = './archive', block_size: int = BLOCK_SIZE, segment_size: int = SEGMENT_SIZE,
+                 level: int = LEVEL, flush_interval: float = None, decoder: Decoder = None):
+        """
+        :param path: str, the folder of the archive
+        :param block_size: int, count of tweets compressed in one block, larger blocks compress better
+                           and random access is slower
+        :param segment_size: int, start a new segment when a segment is larger than this size in bytes
+        :param level: int, level of zlib compression
+        :param flush_interval: float, write a block when a tweet stays in the buffer longer, None to disable
+        """
+        super().__init__(block_size, flush_interval)
+        self.path = os.path.abspath(path)
+        self.segment_size = segment_size
+        self.level = level
+        self.decoder = Decoder() if decoder is None else decoder
+        self.users = {}
+        self.cache = None, None
+        os.makedirs(self.path, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(self.path, 'index.db'), check_same_thread=False)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS blocks ('
+                              'segment INTEGER, offset INTEGER, size INTEGER, count INTEGER, '
+                              'PRIMARY KEY (segment, offset))')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS tweets ('
+                              'id INTEGER PRIMARY KEY, segment INTEGER, offset INTEGER, position INTEGER)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS tweets_block ON tweets (segment, offset)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, data TEXT)')
+        self.segment, self.file = self._open()
+
+    def _segment_path(self, segment: int):
+        return os.path.join(self.path, 'segment-{:06d}.dat'.format(segment))
+
+    def _open(self):
+        row = self.conn.execute('SELECT segment, offset + size FROM blocks '
+                                'ORDER BY segment DESC, offset DESC LIMIT 1').fetchone()
+        segment, end = row if row is not None else (1, 0)
+        f = open(self._segment_path(segment), 'ab')
+        # Drop the block written but not indexed, e.g. the session crashed before the index is committed
+        if f.tell() > end:
+            f.truncate(end)
+            f.seek(end)
+        return segment, f
+
+    def _write(self, batch: list):
+        users = {}
+        records = [_strip(tweet, users) for tweet in batch]
+        data = zlib.compress(json.dumps(records, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+                             self.level)
+        if self.file.tell() > 0 and self.file.tell() + HEADER.size + len(data) > self.segment_size:
+            self.file.close()
+            self.segment += 1
+            self.file = open(self._segment_path(self.segment), 'ab')
+        offset = self.file.tell()
+        self.file.write(HEADER.pack(len(data)))
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        # The block is on the disk before it is indexed
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?)',
+                              (self.segment, offset, HEADER.size + len(data), len(records)))
+            self.conn.executemany('INSERT OR REPLACE INTO tweets VALUES (?, ?, ?, ?)',
+                                  [(record['id'], self.segment, offset, position)
+                                   for position, record in enumerate(records)])
+            self.conn.executemany('INSERT OR REPLACE INTO users VALUES (?, ?)',
+                                  [(user_id, json.dumps(user, ensure_ascii=False))
+                                   for user_id, user in users.items()])
+        for user_id, user in users.items():
+            if user_id in self.users:
+                self.users[user_id] = user
+
+    def _block(self, segment: int, offset: int) -> list:
+        if self.cache[0] == (segment, offset):
+            return self.cache[1]
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            size, = HEADER.unpack(f.read(HEADER.size))
+            records = self.decoder.loads(zlib.decompress(f.read(size)))
+        self.cache = (segment, offset), records
+        return records
+
+    def _users(self, records: list) -> dict:
+        """
+        :return: dict of user id to the user object of all the users in the records
+        """
+        user_ids = set()
+        for record in records:
+            _user_ids(record, user_ids)
+        missing = [user_id for user_id in user_ids if user_id not in self.users]
+        if len(self.users) + len(missing) > USER_CACHE:
+            self.users = {}
+            missing = list(user_ids)
+        for i in range(0, len(missing), USER_BATCH):
+            batch = missing[i:i + USER_BATCH]
+            rows = self.conn.execute('SELECT id, data FROM users WHERE id IN ({})'.format(
+                ','.join('?' * len(batch))), batch)
+            for user_id, data in rows:
+                self.users[user_id] = self.decoder.loads(data)
+        return self.users
+
+    def get(self, tweet_id) -> Tweet:
+        """
+        :return: the tweet of the id, or None if it is not in the archive
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT segment, offset, position FROM tweets WHERE id = ?',
+                                    (tweet_id,)).fetchone()
+            if row is None:
+                return None
+            record = self._block(row[0], row[1])[row[2]]
+            return Tweet(_restore(record, self._users([record])))
+
+    def __iter__(self) -> Iterable[Tweet]:
+        """
+        Read all the tweets in the order they were written, the buffer is written first.
+        :return: iterable list of tweet objects
+        """
+        self.flush()
+        blocks = self.conn.execute('SELECT segment, offset FROM blocks ORDER BY segment, offset').fetchall()
+        for segment, offset in blocks:
+            with self.lock:
+                positions = set(row[0] for row in self.conn.execute(
+                    'SELECT position FROM tweets WHERE segment = ? AND offset = ?', (segment, offset)))
+                if len(positions) <= 0:
+                    continue
+                records = self._block(segment, offset)
+                users = self._users(records)
+                tweets = [Tweet(_restore(record, users)) for position, record in enumerate(records)
+                          if position in positions]
+            for tweet in tweets:
+                yield tweet
+
+    def ids(self) -> Iterable[int]:
+        """
+        :return: iterable list of all the tweet ids, newest first
+        """
+        for row in self.conn.execute('SELECT id FROM tweets ORDER BY id DESC').fetchall():
+            yield row[0]
+
+    def __contains__(self, tweet_id):
+        return self.conn.execute('SELECT 1 FROM tweets WHERE id = ?', (tweet_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM tweets').fetchone()[0]
+
+    def close(self):
+        super().close()
+        with self.lock:
+            self.file.close()
+            self.conn.close()
+
+
+def _strip(tweet: dict, users: dict) -> dict:
+    """
+    Replace the user objects in the tweet with the user ids, collect the users into the dict.
+    """
+    tweet = dict(tweet)
+    # Documents from MongoDB
+    tweet.pop('_id', None)
+    user = tweet.get('user')
+    if isinstance(user, dict) and 'id' in user:
+        # A trimmed user only has `id` and `id_str`, never overwrite the complete one with it
+        if 'screen_name' in user:
+            users[user['id']] = user
+        tweet['user'] = user['id']
+    for key in NESTED:
+        if isinstance(tweet.get(key), dict):
+            tweet[key] = _strip(tweet[key], users)
+    return tweet
+
+
+def _restore(record: dict, users: dict) -> dict:
+    record = dict(record)
+    user_id = record.get('user')
+    if user_id is not None and not isinstance(user_id, dict):
+        # The user has only been archived trimmed
+        record['user'] = users.get(user_id, {'id': user_id, 'id_str': str(user_id)})
+    for key in NESTED:
+        if isinstance(record.get(key), dict):
+            record[key] = _restore(record[key], users)
+    return record
+
+
+def _user_ids(record: dict, user_ids: set):
+    user_id = record.get('user')
+    if user_id is not None and not isinstance(user_id, dict):
+        user_ids.add(user_id)
+    for key in NESTED:
+        if isinstance(record.get(key), dict):
+            _user_ids(record[key], user_ids)
@@ -0,0 +1,571 @@
+import asyncio
+import os
+import sys
+from time import perf_counter
+from typing import Union
+
+from spiderutil.exceptions import RetryLimitExceededException, NetworkException, SpiderException, \
+    UnauthorizedException
+from spiderutil.path import PathGenerator
+
+from .checkpoint import Checkpoint
+from .decoder import Decoder
+from .manifest import Manifest
+from .metrics import Metrics
+from .ratelimit import RateLimiter, TokenPool
+from .store import StoreByContent
+from .sync import SyncState
+from .tweet import Tweet
+from .twitter import TwitterSpider, TwitterDownloader, DELAY, RETRY, LOOKUP_SIZE, FOLLOWING_IDS_SIZE, \
+    CHUNK_SIZE, _content_range_total
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+if sys.version_info[0] > 2:
+    import urllib.parse as urlparse
+else:
+    import urlparse
+
+CONNECTIONS = 100
+PER_HOST = 16
+CONCURRENCY = 8
+TIMEOUT = 30
+
+_END = object()
+
+
+def _client(connections: int, per_host: int = 0, timeout: float = TIMEOUT):
+    if aiohttp is None:
+        raise ImportError('aiohttp is not installed.')
+    # Connections are kept alive and reused by all the requests of the session
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=connections, limit_per_host=per_host),
+                                 timeout=aiohttp.ClientTimeout(total=None, sock_connect=timeout,
+                                                               sock_read=timeout))
+
+
+def _proxy(proxies: dict):
+    if proxies is None:
+        return None
+    return proxies.get('https', proxies.get('http'))
+
+
+async def _iterate(items):
+    # Accept both iterable and async iterable
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+class AsyncTwitterSpider(TwitterSpider):
+    """
+    Spider to crawl tweets with asyncio, all the requests share a pool of keep-alive connections.
+    The API methods of TwitterSpider (timeline, likes, following_ids, ...) return awaitables,
+    the crawl methods are async generators of tweet objects.
+
+        async with AsyncTwitterSpider(token) as spider:
+            async for tweet in spider.crawl_following(screen_name='twitter', concurrency=16):
+                ...
+    """
+
+    def __init__(self, token: Union[str, list, TokenPool], proxies: dict = None, delay=DELAY, retry=RETRY,
+                 logger=None, session=None, limiter: RateLimiter = None, fields: tuple = None,
+                 decoder: Decoder = None, metrics: Metrics = None, connections: int = CONNECTIONS,
+                 timeout: float = TIMEOUT):
+        """
+        :param session: aiohttp.ClientSession, created in the running event loop when the first request is sent
+        :param connections: int, the limit of connections kept by the session, i.e. requests in flight
+        :param timeout: float, timeout of connecting and of every read in seconds
+        """
+        if aiohttp is None:
+            raise ImportError('aiohttp is not installed.')
+        super().__init__(token, delay=delay, retry=retry, logger=logger, limiter=limiter, fields=fields,
+                         decoder=decoder, metrics=metrics)
+        self.session = session
+        self.proxy = _proxy(proxies)
+        self.connections = connections
+        self.timeout = timeout
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def crawl_timeline(self, screen_name: str = None, user_id: str = None,
+                             include_retweets: bool = True, exclude_replies: bool = True,
+                             start_id=None, since_id=None, delay: float = None):
+        """
+        Crawl the timeline of specified user, see `TwitterSpider.crawl_timeline`.
+        :return: async iterable list of tweet objects
+        """
+        if delay is None:
+            delay = self.delay
+
+        self.logger.info('Crawling timeline: %s', locals())
+
+        max_id = start_id
+        while True:
+            tweets = await self.timeline(screen_name=screen_name, user_id=user_id, include_rts=include_retweets,
+                                         exclude_replies=exclude_replies, max_id=max_id, since_id=since_id)
+            if len(tweets) <= 0:
+                return
+            for tweet in tweets:
+                yield Tweet(tweet)
+            # The max id is inclusive, continue from the one older than the last tweet
+            max_id = tweets[-1]['id'] - 1
+            await asyncio.sleep(delay)
+
+    async def crawl_likes(self, screen_name: str = None, user_id: str = None,
+                          start_id=None, since_id=None, delay: float = None):
+        """
+        Crawl the likes of specified user, see `TwitterSpider.crawl_likes`.
+        :return: async iterable list of tweet objects
+        """
+        if delay is None:
+            delay = self.delay
+
+        self.logger.info('Crawling likes: %s', locals())
+
+        max_id = start_id
+        while True:
+            tweets = await self.likes(screen_name=screen_name, user_id=user_id, max_id=max_id, since_id=since_id)
+            if len(tweets) <= 0:
+                return
+            for tweet in tweets:
+                yield Tweet(tweet)
+            max_id = tweets[-1]['id'] - 1
+            await asyncio.sleep(delay)
+
+    async def crawl_following(self, screen_name: str = None, user_id: str = None,
+                              include_retweets: bool = True, exclude_replies: bool = True,
+                              checkpoint: Checkpoint = None, delay: float = None, ids: bool = True,
+                              state: SyncState = None, concurrency: int = CONCURRENCY):
+        """
+        Crawl the timelines of all the users followed by specified user, see `TwitterSpider.crawl_following`.
+        Up to `concurrency` timelines are crawled at the same time, so the tweets of different users
+        are interleaved, and a checkpoint taken from the tweets is only exact when concurrency is 1.
+        :param concurrency: int, count of timelines crawled at the same time
+        :return: async iterable list of tweet objects
+        """
+        if delay is None:
+            delay = self.delay
+        cursor = checkpoint.cursor if checkpoint is not None else None
+        start = checkpoint is None or checkpoint.start
+
+        self.logger.info('Crawling following: %s', locals())
+
+        async def timelines():
+            nonlocal start
+            async for following_id in self._crawl_following(screen_name=screen_name, user_id=user_id,
+                                                            cursor=cursor, ids=ids, delay=delay):
+                start_id = None
+                if not start:
+                    if following_id != checkpoint.user_id:
+                        continue
+                    start = True
+                    start_id = checkpoint.tweet_id
+                since_id = state.get(following_id) if state is not None else None
+                yield following_id, start_id, self.crawl_timeline(
+                    user_id=following_id, include_retweets=include_retweets, exclude_replies=exclude_replies,
+                    start_id=start_id, since_id=since_id, delay=delay)
+
+        async for following_id, newest, tweet in self._merge(timelines(), concurrency):
+            if tweet is not None:
+                yield tweet
+            elif state is not None and newest is not None:
+                # All the tweets of the user have been yielded
+                state.set(following_id, newest)
+
+    async def crawl_timelines(self, user_ids, include_retweets: bool = True, exclude_replies: bool = True,
+                              delay: float = None, concurrency: int = CONCURRENCY):
+        """
+        Crawl the timelines of many users at the same time.
+        :param user_ids: iterable or async iterable list of user ids
+        :param concurrency: int, count of timelines crawled at the same time
+        :return: async iterable list of tweet objects
+        """
+        async def timelines():
+            async for user_id in _iterate(user_ids):
+                yield user_id, None, self.crawl_timeline(user_id=user_id, include_retweets=include_retweets,
+                                                         exclude_replies=exclude_replies, delay=delay)
+
+        async for _, _, tweet in self._merge(timelines(), concurrency):
+            if tweet is not None:
+                yield tweet
+
+    async def _merge(self, timelines, concurrency: int):
+        """
+        Run the timelines concurrently and yield (user id, None, tweet) as the tweets arrive,
+        and (user id, newest tweet id, None) once a timeline is finished.
+        """
+        queue = asyncio.Queue(maxsize=concurrency * 2)
+        slots = asyncio.Semaphore(concurrency)
+
+        async def drain(following_id, newest, timeline):
+            try:
+                async for tweet in timeline:
+                    if newest is None or tweet.id > newest:
+                        newest = tweet.id
+                    await queue.put((following_id, None, tweet))
+                await queue.put((following_id, newest, None))
+            except Exception as e:
+                await queue.put(e)
+            finally:
+                slots.release()
+
+        async def produce():
+            tasks = set()
+            try:
+                async for following_id, newest, timeline in timelines:
+                    await slots.acquire()
+                    task = asyncio.ensure_future(drain(following_id, newest, timeline))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if len(tasks) > 0:
+                    await asyncio.wait(tasks)
+                await queue.put(_END)
+            except Exception as e:
+                await queue.put(e)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+    async def crawl_following_ids(self, screen_name: str = None, user_id: str = None, delay: float = None):
+        """
+        Crawl the ids of all the users followed by specified user, 5000 ids per request.
+        :return: async iterable list of user ids
+        """
+        if delay is None:
+            delay = self.delay
+
+        self.logger.info('Crawling following IDs: %s', locals())
+
+        async for following_id in self._crawl_following(screen_name=screen_name, user_id=user_id,
+                                                        ids=True, delay=delay):
+            yield following_id
+
+    async def _crawl_following(self, screen_name: str = None, user_id: str = None, cursor=None,
+                               ids: bool = True, delay: float = None):
+        cursor = -1 if cursor is None else cursor
+        while True:
+            if ids:
+                users = await self.following_ids(screen_name=screen_name, user_id=user_id, cursor=cursor,
+                                                 count=FOLLOWING_IDS_SIZE)
+                following = users['ids']
+            else:
+                users = await self.following(screen_name=screen_name, user_id=user_id, cursor=cursor)
+                following = [user['id'] for user in users['users']]
+            for following_id in following:
+                yield following_id
+            cursor = users['next_cursor']
+            # The cursor is 0 at the last page
+            if len(following) <= 0 or cursor == 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def lookup_users(self, user_ids, include_entitles: bool = None):
+        """
+        Fetch users in bulk, up to 100 users per request, see `TwitterSpider.lookup_users`.
+        :param user_ids: iterable or async iterable list of user ids
+        :return: async iterable list of user objects
+        """
+        async for batch in _batches(user_ids, LOOKUP_SIZE):
+            for user in await self.users(user_ids=batch, include_entitles=include_entitles):
+                yield user
+
+    async def lookup_tweets(self, tweet_ids, trim_user: bool = None, include_entitles: bool = None):
+        """
+        Fetch tweets in bulk, up to 100 tweets per request, see `TwitterSpider.lookup_tweets`.
+        :param tweet_ids: iterable or async iterable list of tweet ids
+        :return: async iterable list of tweet objects
+        """
+        async for batch in _batches(tweet_ids, LOOKUP_SIZE):
+            for tweet in await self.lookup(batch, trim_user=trim_user, include_entitles=include_entitles):
+                yield Tweet(tweet)
+
+    def _client(self):
+        if self.session is None:
+            self.session = _client(self.connections, timeout=self.timeout)
+        return self.session
+
+    async def _get(self, url, params, fields: tuple = None):
+        """
+        Access API with aiohttp and return the result with the format of json, see `TwitterSpider._get`.
+        """
+        endpoint = urlparse.urlparse(url).path
+        session = self._client()
+        # aiohttp does not drop the parameters of None or convert the booleans like requests
+        params = {key: str(value).lower() if isinstance(value, bool) else str(value)
+                  for key, value in params.items() if value is not None}
+        retry = self.retry if self.retry else 1
+        limited = len(self.tokens) * retry
+        while True:
+            token, delay = self.tokens.acquire(endpoint)
+            if delay > 0:
+                if delay > 1:
+                    self.logger.info('Waiting %.1fs for the rate limit of %s', delay, endpoint)
+                self.metrics.inc('twitter_api_wait_seconds_total', delay, endpoint=endpoint)
+                await asyncio.sleep(delay)
+            start = perf_counter()
+            try:
+                async with session.get(url, params=params, headers={'Authorization': token},
+                                       proxy=self.proxy) as r:
+                    status, headers = r.status, r.headers
+                    content = await r.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._measure(endpoint, 'error', perf_counter() - start, params=params)
+                retry -= 1
+                if retry <= 0:
+                    raise RetryLimitExceededException(url) from e
+                continue
+            self._measure(endpoint, status, perf_counter() - start, len(content), params)
+            self.tokens.update(token, endpoint, headers)
+            remaining = self.tokens.remaining(endpoint)
+            if remaining is not None:
+                self.metrics.set('twitter_api_rate_limit_remaining', remaining, endpoint=endpoint)
+            if status == 200:
+                return self.decoder.decode(content, fields)
+            if status == 429:
+                limited -= 1
+                if limited <= 0:
+                    raise RetryLimitExceededException(url)
+                self.logger.warning('Rate limit exceeded: %s', endpoint)
+                self.tokens.exhaust(token, endpoint)
+                continue
+            if status == 401:
+                raise UnauthorizedException(url)
+            retry -= 1
+            if retry <= 0:
+                raise RetryLimitExceededException(url) from NetworkException(
+                    'Error Code: {} - {}'.format(status, url))
+
+
+async def _batches(items, size: int):
+    batch = []
+    async for item in _iterate(items):
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+class AsyncTwitterDownloader(TwitterDownloader):
+    """
+    Download the media of tweets with asyncio, all the downloads share a pool of keep-alive connections.
+    Paths are generated by the PathGenerator and the manifest is checked the same as TwitterDownloader.
+    """
+
+    def __init__(self, path: PathGenerator = None, proxies: dict = None, retry=RETRY,
+                 logger=None, session=None, chunk_size: int = CHUNK_SIZE,
+                 manifest: Manifest = None, metrics: Metrics = None, connections: int = CONNECTIONS,
+                 per_host: int = PER_HOST, timeout: float = TIMEOUT):
+        """
+        :param session: aiohttp.ClientSession, created in the running event loop when the first request is sent
+        :param connections: int, the global limit of concurrent downloads
+        :param per_host: int, the limit of concurrent downloads to the same host
+        :param timeout: float, timeout of connecting and of every read in seconds
+        """
+        if aiohttp is None:
+            raise ImportError('aiohttp is not installed.')
+        super().__init__(path, retry=retry, logger=logger, chunk_size=chunk_size, manifest=manifest,
+                         metrics=metrics)
+        self.session = session
+        self.proxy = _proxy(proxies)
+        self.connections = connections
+        self.per_host = per_host
+        self.timeout = timeout
+        # Partial files being written, to the events set once they are done
+        self.fetching = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _client(self):
+        if self.session is None:
+            self.session = _client(self.connections, self.per_host, self.timeout)
+        return self.session
+
+    async def _get(self, url, offset: int = 0):
+        """
+        Open a streaming response of the url, start from the offset with a Range request.
+        """
+        headers = {'Accept-Encoding': 'identity'}
+        if offset > 0:
+            headers['Range'] = 'bytes={}-'.format(offset)
+        host = urlparse.urlparse(url).netloc
+        start = perf_counter()
+        try:
+            r = await self._client().get(url, headers=headers, proxy=self.proxy)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.metrics.inc('twitter_download_requests_total', host=host, status='error')
+            raise
+        self.metrics.inc('twitter_download_requests_total', host=host, status=r.status)
+        self.metrics.observe('twitter_download_response_seconds', perf_counter() - start, host=host)
+        return r
+
+    async def _save(self, r, path, offset: int = 0):
+        """
+        Write the streaming response into the (partial) file in chunks.
+        :return: the expected size of the whole file, or None if unknown
+        """
+        url = str(r.url)
+        if r.status == 206:
+            mode = 'ab'
+            total = _content_range_total(r)
+        elif r.status == 200:
+            mode, offset = 'wb', 0
+            total = r.content_length
+        elif r.status == 416 and _content_range_total(r) == offset:
+            return offset
+        else:
+            if r.status == 416:
+                os.remove(path)
+            raise NetworkException('Error Code: {} - {}'.format(r.status, url))
+        size = 0
+        try:
+            with open(path, mode) as f:
+                async for chunk in r.content.iter_chunked(self.chunk_size):
+                    f.write(chunk)
+                    size += len(chunk)
+                f.flush()
+                # Do not block the event loop while the file is synced to the disk
+                await asyncio.get_running_loop().run_in_executor(None, os.fsync, f.fileno())
+        finally:
+            self.metrics.inc('twitter_download_bytes_total', size, host=urlparse.urlparse(url).netloc)
+        return total
+
+    async def fetch(self, url, path, media_id=None):
+        """
+        Download the url into the path, see `TwitterDownloader.fetch`.
+        :return: bool, False if the path already exists
+        """
+        partial = self._partial(url, path)
+        # Wait for the fetch of the same medium, e.g. another retweet of the same tweet
+        while partial in self.fetching:
+            await self.fetching[partial].wait()
+        if os.path.exists(path):
+            self.logger.warning('File %s exists.', path)
+            if isinstance(self.path, StoreByContent):
+                self.path.link(path)
+            return False
+        self.fetching[partial] = done = asyncio.Event()
+        try:
+            return await self._fetch(url, path, partial, media_id)
+        finally:
+            del self.fetching[partial]
+            done.set()
+
+    async def _fetch(self, url, path, partial, media_id=None):
+        retry = self.retry if self.retry else 1
+        start = perf_counter()
+        while True:
+            try:
+                offset = os.path.getsize(partial) if os.path.isfile(partial) else 0
+                async with await self._get(url, offset) as r:
+                    total = await self._save(r, partial, offset)
+                size = os.path.getsize(partial)
+                if total is not None and size != total:
+                    if size > total:
+                        os.remove(partial)
+                    raise NetworkException('Incomplete file {}/{} - {}'.format(size, total, url))
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError, SpiderException) as e:
+                retry -= 1
+                if retry <= 0:
+                    self.metrics.inc('twitter_download_failures_total')
+                    self.metrics.request('download', url, 'error', perf_counter() - start)
+                    raise RetryLimitExceededException(url) from e
+        os.replace(partial, path)
+        seconds = perf_counter() - start
+        self.metrics.inc('twitter_files_written_total')
+        self.metrics.observe('twitter_download_seconds', seconds)
+        self.metrics.request('download', url, 200, seconds, size)
+        self.logger.debug('Downloaded %s %d bytes %.3fs', url, size, seconds,
+                          extra={'event': 'download', 'url': url, 'path': path, 'bytes': size, 'duration': seconds})
+        if isinstance(self.path, StoreByContent):
+            self.path.link(path)
+        if self.manifest is not None:
+            self.manifest.add(path, media_id=media_id, url=url)
+        return True
+
+    async def download(self, tweet: Tweet):
+        """
+        Download all the media of the tweet concurrently.
+        """
+        results = await asyncio.gather(*[self.fetch(medium.url, path, media_id=medium.id)
+                                         for medium, path in self.tasks(tweet)], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        self.mark(tweet)
+
+    async def download_all(self, tweets, source: bool = False, queue_size: int = None):
+        """
+        Download the media of a stream of tweets concurrently, see `DownloadPool.download`.
+        :param tweets: iterable or async iterable list of tweet objects,
+                       e.g. the async generator of `AsyncTwitterSpider.crawl_timeline`
+        :param source: bool, download the media of the source tweet (the original one of a retweet)
+                       instead, the tweet itself is still returned
+        :param queue_size: int, the limit of tweets being downloaded, default is the count of connections
+        :return: async iterable list of (tweet, error)
+        """
+        queue_size = self.connections if queue_size is None else queue_size
+        pending = set()
+        try:
+            async for tweet in _iterate(tweets):
+                pending.add(asyncio.ensure_future(self._download(tweet, source)))
+                # Backpressure, wait until the pool is not full
+                while len(pending) >= queue_size:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+            while len(pending) > 0:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _download(self, tweet: Tweet, source: bool):
+        try:
+            await self.download(tweet.source if source else tweet)
+        except Exception as e:
+            self.logger.error('Failed to download %s: %s', tweet.id, e)
+            return tweet, e
+        return tweet, None
@@ -1,11 +1,19 @@
 import json
 import os
+from time import time
 
 from spiderutil.structure import Dict
 
+COMPACT_EVERY = 1000
+COMPACT_INTERVAL = 60
+
 
 class Checkpoint(Dict):
 
+    def __new__(cls, source=None, **kwargs):
+        # `Dict` returns the source itself if it is not a dict, which is None for an empty checkpoint
+        return super(Checkpoint, cls).__new__(cls, {} if source is None else source, **kwargs)
+
     def __init__(self, source=None, cursor=None, user_id=None, tweet_id=None):
         super(Checkpoint, self).__init__(source=source, cursor=cursor, user_id=user_id, tweet_id=tweet_id)
 
@@ -14,9 +22,14 @@ class Checkpoint(Dict):
         return self.user_id is None
 
     def save(self, path):
+        # Write into a temporary file and rename it, so the checkpoint is never half written
         path = os.path.abspath(path)
-        with open(path, 'w', encoding='utf-8') as f:
+        temp = path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
             json.dump(self, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
 
     def update(self, cursor=None, user_id=None, tweet_id=None):
         if self.cursor is None or (cursor is not None and cursor > self.cursor):
@@ -28,9 +41,89 @@ class Checkpoint(Dict):
 
     @staticmethod
     def load_file(path):
+        """
+        Load the checkpoint, and replay the journal of `CheckpointWriter` if it exists.
+        """
         path = os.path.abspath(path)
         if os.path.isfile(path):
             with open(path, 'r', encoding='utf-8') as f:
-                return Checkpoint(json.load(f))
+                checkpoint = Checkpoint(json.load(f))
         else:
-            return Checkpoint()
+            checkpoint = Checkpoint()
+        journal = CheckpointWriter.journal_path(path)
+        if os.path.isfile(journal):
+            with open(journal, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        checkpoint.update(**json.loads(line))
+                    except ValueError:
+                        # The last line may be cut off by a crash
+                        break
+        return checkpoint
+
+
+class CheckpointWriter:
+    """
+    Persist a checkpoint with an append-only journal.
+
+    Every update is appended to the journal as one line of JSON,
+    and the journal is compacted into the checkpoint file every `every` updates
+    or `interval` seconds. `Checkpoint.load_file` replays the journal after a crash.
+    """
+
+    def __init__(self, path: str, checkpoint: Checkpoint = None,
+                 every: int = COMPACT_EVERY, interval: float = COMPACT_INTERVAL, fsync: bool = False):
+        """
+        :param path: str, path of the checkpoint file, the journal is saved beside it
+        :param checkpoint: Checkpoint, loaded from the path if not specified
+        :param every: int, compact the journal every N updates
+        :param interval: float, compact the journal every T seconds
+        :param fsync: bool, sync every update to the disk, survive power loss besides crashes
+        """
+        self.path = os.path.abspath(path)
+        self.checkpoint = Checkpoint.load_file(self.path) if checkpoint is None else checkpoint
+        self.every = every
+        self.interval = interval
+        self.fsync = fsync
+        self.count = 0
+        self.last = time()
+        # Start from a compacted checkpoint
+        self.checkpoint.save(self.path)
+        self.file = open(self.journal_path(self.path), 'w', encoding='utf-8')
+
+    @staticmethod
+    def journal_path(path):
+        return path + '.journal'
+
+    def update(self, cursor=None, user_id=None, tweet_id=None):
+        self.checkpoint.update(cursor=cursor, user_id=user_id, tweet_id=tweet_id)
+        entry = dict((k, v) for k, v in (('cursor', cursor), ('user_id', user_id), ('tweet_id', tweet_id))
+                     if v is not None)
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.count += 1
+        if self.count >= self.every or time() - self.last >= self.interval:
+            self.compact()
+
+    def compact(self):
+        """
+        Save the checkpoint atomically and empty the journal.
+        """
+        self.checkpoint.save(self.path)
+        self.file.seek(0)
+        self.file.truncate()
+        self.count = 0
+        self.last = time()
+
+    def close(self):
+        self.compact()
+        self.file.close()
+        os.remove(self.journal_path(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,43 @@
+import json
+
+from .tweet import Tweet, USER_FIELDS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Decoder:
+    """
+    Decode the content of API responses from bytes directly.
+    Use orjson if it is installed, otherwise the json module of the standard library.
+    """
+
+    def __init__(self, backend: str = None):
+        """
+        :param backend: str, `orjson` or `json`, default is orjson if it is installed
+        """
+        if backend is None:
+            backend = 'orjson' if orjson is not None else 'json'
+        if backend == 'orjson':
+            if orjson is None:
+                raise ImportError('orjson is not installed.')
+            self.loads = orjson.loads
+        elif backend == 'json':
+            self.loads = json.loads
+        else:
+            raise ValueError('Unknown backend {}.'.format(backend))
+        self.backend = backend
+
+    def decode(self, content: bytes, fields: tuple = None, user_fields: tuple = USER_FIELDS):
+        """
+        :param content: bytes, the content of the response
+        :param fields: tuple, project every tweet in the list to these fields, see `Tweet.compact`
+        :param user_fields: tuple, project the user of every tweet to these fields
+        :return: the decoded json object
+        """
+        data = self.loads(content)
+        if fields is not None and isinstance(data, list):
+            data = [Tweet.compact(tweet, fields, user_fields) for tweet in data]
+        return data
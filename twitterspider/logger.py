@@ -0,0 +1,147 @@
+import json
+import logging
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
+from time import monotonic
+
+# Attributes of every log record, the others are the extra fields
+RECORD_FIELDS = frozenset(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+
+def create_logger(name: str = 'TwitterSpider', path: str = './twitter.log', level: str = 'INFO',
+                  structured: bool = True, sample: float = 1.0, rate: float = None, console: bool = False,
+                  mode: str = 'a') -> logging.Logger:
+    """
+    Create a logger which writes in a background thread.
+    Records are put into a queue without being formatted, and formatted and written by the listener.
+    Create it before the spider and the downloader, they share the logger of the same name:
+
+        create_logger(sample=0.1, rate=10)
+        spider = TwitterSpider(token)
+
+    :param name: str, name of the logger
+    :param path: str, the path of logs
+    :param level: str, the level of logs
+    :param structured: bool, write one json object per line, otherwise the plain format of `spiderutil.log.Log`
+    :param sample: float, the ratio of per-request logs kept, see `SamplingFilter`
+    :param rate: float, the limit of per-request logs of every event per second
+    :param console: bool, print the logs to the console too
+    :param mode: str, `a` to append to the file, `w` to overwrite it
+    :return: the logger
+    """
+    logger = logging.getLogger(name)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    logger.propagate = False
+    logger.setLevel(level)
+
+    if structured:
+        formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter(fmt='[%(levelname)s]\t%(asctime)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    handlers = [logging.FileHandler(path, encoding='utf-8', mode=mode)]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue = Queue()
+    listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    handler = DeferredQueueHandler(queue, listener)
+    if sample < 1.0 or rate is not None:
+        # Dropped before being queued
+        handler.addFilter(SamplingFilter(sample=sample, rate=rate))
+    logger.addHandler(handler)
+    listener.start()
+    return logger
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Put the records into the queue as they are, the message is formatted by the listener.
+    The arguments of a record must not be modified after the record is logged.
+    """
+
+    def __init__(self, queue: Queue, listener: QueueListener):
+        super().__init__(queue)
+        self.listener = listener
+        self.stopped = False
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def close(self):
+        # Called by `logging.shutdown` at exit, the records left in the queue are written
+        if not self.stopped:
+            self.stopped = True
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+        super().close()
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Format a record as a json object of time, level, event, message and the extra fields, e.g.
+
+        logger.info('Downloaded %s', url, extra={'event': 'download', 'duration': 0.25})
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': record.created,
+            'level': record.levelname,
+            'event': getattr(record, 'event', None),
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_FIELDS and key not in data:
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Sample and rate-limit the per-request logs, i.e. the records with an `event` field.
+    Warnings, errors, failed requests, i.e. a `status` field other than 200, and the records without an event
+    are always kept.
+    """
+
+    def __init__(self, sample: float = 1.0, rate: float = None):
+        """
+        :param sample: float, the ratio of records kept
+        :param rate: float, the limit of records of every event per second, None for no limit
+        """
+        super().__init__()
+        self.sample = sample
+        self.rate = rate
+        self.buckets = {}
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, 'event', None)
+        if record.levelno >= logging.WARNING or event is None or getattr(record, 'status', 200) != 200:
+            return True
+        if self.sample < 1.0 and random.random() >= self.sample:
+            with self.lock:
+                self.dropped += 1
+            return False
+        if self.rate is None:
+            return True
+        with self.lock:
+            # Token bucket of every event, holds up to one second of records
+            now = monotonic()
+            tokens, last = self.buckets.get(event, (self.rate, now))
+            tokens = min(max(self.rate, 1), tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self.buckets[event] = tokens, now
+                self.dropped += 1
+                return False
+            self.buckets[event] = tokens - 1, now
+        return True
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class Manifest:
+    """
+    Persistent local manifest of downloaded media, backed by SQLite.
+    Media are looked up by media id or url, every record keeps the path, size and hash of the file.
+    """
+
+    def __init__(self, path: str = './manifest.db'):
+        self.path = os.path.abspath(path)
+        self.lock = threading.Lock()
+        # Shared by the download threads, guarded by the lock
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS media ('
+                              'path TEXT PRIMARY KEY, media_id INTEGER, url TEXT, '
+                              'file_name TEXT, size INTEGER, hash TEXT)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS media_id ON media (media_id)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS media_url ON media (url)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS media_hash ON media (hash)')
+
+    def find(self, media_id=None, url=None):
+        """
+        Find the record of a medium whose file is still on the disk.
+        :param media_id: int, id of the medium
+        :param url: str, url of the medium
+        :return: dict of path, media_id, url, size and hash, or None if not downloaded
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT path, media_id, url, size, hash FROM media '
+                                     'WHERE media_id = ? OR url = ?', (media_id, url)).fetchall()
+        for path, media_id, url, size, digest in rows:
+            if os.path.isfile(path) and os.path.getsize(path) == size:
+                return {'path': path, 'media_id': media_id, 'url': url, 'size': size, 'hash': digest}
+        return None
+
+    def find_hash(self, digest: str):
+        """
+        :return: path of an existing file with the hash, or None
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT path, size FROM media WHERE hash = ?', (digest,)).fetchall()
+        for path, size in rows:
+            if os.path.isfile(path) and os.path.getsize(path) == size:
+                return path
+        return None
+
+    def add(self, path: str, media_id=None, url: str = None, digest: str = None):
+        """
+        Record a downloaded file.
+        :param path: str, path of the file
+        :param media_id: int, id of the medium
+        :param url: str, url of the medium
+        :param digest: str, sha256 of the file, calculated if not specified
+        """
+        path = os.path.abspath(path)
+        size = os.path.getsize(path)
+        if digest is None:
+            digest = self.hash(path)
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?)',
+                              (path, media_id, url, os.path.basename(path), size, digest))
+
+    def rebuild(self, folder: str):
+        """
+        Rebuild the manifest from an existing download tree.
+        Files are recorded by path, size and hash, the media id and url of a path already
+        in the manifest are kept. Records whose file no longer exists are removed.
+        Only the size and hash of other files are known, except the blobs of `StoreByContent`
+        which are named by their media id, the names generated by `StoreByUserName` do not tell
+        the medium, so `find` never matches those files and their media are downloaded again.
+        :param folder: str, the root of the download tree
+        :return: int, count of files recorded
+        """
+        with self.lock:
+            known = dict((path, (media_id, url)) for path, media_id, url in
+                         self.conn.execute('SELECT path, media_id, url FROM media'))
+        count = 0
+        for root, _, files in os.walk(os.path.abspath(folder)):
+            for file_name in files:
+                # Skip the partial and segmented files of unfinished downloads, and the record of the ranges
+                if file_name.startswith('.') and file_name.endswith(('.part', '.seg', '.ranges', '.ranges.tmp')):
+                    continue
+                path = os.path.join(root, file_name)
+                if path == self.path:
+                    continue
+                media_id, url = known.get(path, (_blob_id(path), None))
+                self.add(path, media_id=media_id, url=url)
+                count += 1
+        with self.lock, self.conn:
+            for path in known:
+                if not os.path.isfile(path):
+                    self.conn.execute('DELETE FROM media WHERE path = ?', (path,))
+        return count
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    @staticmethod
+    def hash(path: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+
+def _blob_id(path: str):
+    """
+    :return: the media id of a blob of `StoreByContent`, i.e. `.blobs/89/1234567889.jpg`, otherwise None
+    """
+    key = os.path.splitext(os.path.basename(path))[0]
+    folder = os.path.dirname(path)
+    if key.isdigit() and os.path.basename(folder) == key[-2:] \
+            and os.path.basename(os.path.dirname(folder)) == '.blobs':
+        return int(key)
+    return None
@@ -0,0 +1,197 @@
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import time
+
+# Upper bounds of the latency histograms in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DUMP_INTERVAL = 60
+
+
+class Metrics:
+    """
+    Registry of counters, gauges and histograms, every metric is identified by its name and labels.
+
+        metrics.inc('twitter_requests_total', endpoint='friends/ids.json', status=200)
+        metrics.observe('twitter_request_seconds', 0.12, endpoint='friends/ids.json')
+
+    Hooks added by `add_hook` are called with a dict describing every request.
+    """
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.hooks = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # Count of every bucket, then the sum and the count of all observations
+                histogram = self.histograms[key] = [0] * (len(self.buckets) + 2)
+            # The buckets are cumulative, an observation is counted in every bucket it fits
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def add_hook(self, hook):
+        """
+        :param hook: callable, called with a dict of `kind`, `target`, `status`, `seconds` and `bytes`
+                     after every request, in the thread of the request
+        """
+        self.hooks.append(hook)
+
+    def request(self, kind: str, target: str, status, seconds: float, size: int = None):
+        for hook in self.hooks:
+            hook({'kind': kind, 'target': target, 'status': status, 'seconds': seconds, 'bytes': size})
+
+    def snapshot(self) -> dict:
+        """
+        :return: dict of all the metrics, which could be dumped as json
+        """
+        def entries(metrics, value):
+            return [{'name': name, 'labels': dict(labels), 'value': value(v)}
+                    for (name, labels), v in sorted(metrics.items())]
+
+        with self.lock:
+            return {
+                'time': time(),
+                'counters': entries(self.counters, lambda v: v),
+                'gauges': entries(self.gauges, lambda v: v),
+                'histograms': entries(self.histograms, lambda v: {
+                    'buckets': dict(zip([str(b) for b in self.buckets], v[:-2])),
+                    'sum': v[-2], 'count': v[-1]}),
+            }
+
+    def prometheus(self) -> str:
+        """
+        :return: all the metrics in the Prometheus text format
+        """
+        lines = []
+        with self.lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted(set(name for name, _ in metrics)):
+                    lines.append('# TYPE {} {}'.format(name, kind))
+                    for (n, labels), value in sorted(metrics.items()):
+                        if n == name:
+                            lines.append('{}{} {}'.format(name, _labels(labels), value))
+            for name in sorted(set(name for name, _ in self.histograms)):
+                lines.append('# TYPE {} histogram'.format(name))
+                for (n, labels), value in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(self.buckets, value[:-2]):
+                        lines.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', str(bound)),)), count))
+                    lines.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', '+Inf'),)), value[-1]))
+                    lines.append('{}_sum{} {}'.format(name, _labels(labels), value[-2]))
+                    lines.append('{}_count{} {}'.format(name, _labels(labels), value[-1]))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str):
+        """
+        Dump the snapshot into a json file atomically.
+        """
+        path = os.path.abspath(path)
+        temp = path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(temp, path)
+
+
+def _labels(labels: tuple) -> str:
+    if len(labels) <= 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+#: The registry used by default
+REGISTRY = Metrics()
+
+
+class MetricsServer:
+    """
+    Expose the metrics in the Prometheus text format at `http://host:port/metrics`.
+    """
+
+    def __init__(self, metrics: Metrics = None, host: str = '127.0.0.1', port: int = 9108):
+        self.metrics = REGISTRY if metrics is None else metrics
+        self.server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.metrics = self.metrics
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.server.metrics.prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsDumper:
+    """
+    Dump the metrics into a json file periodically.
+    """
+
+    def __init__(self, path: str, metrics: Metrics = None, interval: float = DUMP_INTERVAL):
+        self.path = path
+        self.metrics = REGISTRY if metrics is None else metrics
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.metrics.dump(self.path)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.metrics.dump(self.path)
@@ -0,0 +1,395 @@
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import sleep, time
+
+import requests
+
+if sys.version_info[0] > 2:
+    import urllib.parse as urlparse
+else:
+    import urlparse
+
+# Requests / 15-min window (user auth)
+LIMITS = {
+    'statuses/user_timeline.json': 900,
+    'favorites/list.json': 75,
+    'friends/list.json': 15,
+    'friends/ids.json': 15,
+    'followers/list.json': 15,
+    'followers/ids.json': 15,
+    'statuses/lookup.json': 900,
+    'statuses/show.json': 900,
+    'users/lookup.json': 900,
+    'user/show.json': 900,
+}
+WINDOW = 15 * 60
+MEDIA_HOSTS = ('pbs.twimg.com', 'video.twimg.com')
+UPSTREAM = 'https://api.twitter.com'
+# The id of the k-th tweet of the user is `user_id * TWEET_SPACE + k`
+TWEET_SPACE = 10 ** 6
+USER_BASE = 1000
+
+
+class MockTwitter:
+    """
+    Local stand-in for the Twitter API and the media CDN.
+
+    There are 3 modes:
+    `synthetic` serves generated users, tweets and media, which is deterministic;
+    `record` forwards every request to the real API and the media hosts, and saves the responses;
+    `replay` serves the responses saved by `record`.
+    Media urls in the responses are rewritten to the server, point `TwitterSpider.base_url`
+    to `api_url` and every crawl and download runs offline.
+
+        with MockTwitter(users=10, latency=0.05) as mock:
+            spider = TwitterSpider('token')
+            spider.base_url = mock.api_url
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, mode: str = 'synthetic', path: str = None,
+                 users: int = 10, tweets: int = 1000, media_size: int = 64 * 1024, video_size: int = 1024 * 1024,
+                 latency: float = 0.0, limits: dict = None, window: float = WINDOW,
+                 error_rate: float = 0.0, seed: int = 0, upstream: str = UPSTREAM):
+        """
+        :param host: str, the address to listen on
+        :param port: int, the port to listen on, a free port is chosen by default
+        :param mode: str, `synthetic`, `record` or `replay`
+        :param path: str, the folder of the recorded responses, required by `record` and `replay`
+        :param users: int, count of synthetic users
+        :param tweets: int, count of synthetic tweets of every user
+        :param media_size: int, size of synthetic images in bytes
+        :param video_size: int, size of synthetic videos in bytes
+        :param latency: float, seconds to wait before every response
+        :param limits: dict, requests per window of every endpoint, default is the limits of Twitter,
+                       None values disable the rate limit of the endpoint
+        :param window: float, length of the rate-limit window in seconds
+        :param error_rate: float, probability of injecting a 429 response to an API request
+        :param seed: int, seed of the random error injection
+        :param upstream: str, the real API to record
+        """
+        if mode not in ('synthetic', 'record', 'replay'):
+            raise ValueError('Unknown mode {}.'.format(mode))
+        if mode != 'synthetic' and path is None:
+            raise ValueError('Path is required by {} mode.'.format(mode))
+        self.mode = mode
+        self.path = os.path.abspath(path) if path is not None else None
+        self.users = users
+        self.tweets = tweets
+        self.media_size = media_size
+        self.video_size = video_size
+        self.latency = latency
+        self.limits = dict(LIMITS if limits is None else limits)
+        self.window = window
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.upstream = upstream
+        self.buckets = {}
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+        self.thread = None
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def api_url(self):
+        return self.url + '/1.1/'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def count(self, endpoint: str = None) -> int:
+        """
+        :return: count of requests served of the endpoint, or of all the endpoints
+        """
+        with self.lock:
+            if endpoint is not None:
+                return self.requests.get(endpoint, 0)
+            return sum(self.requests.values())
+
+    def _limit(self, token: str, endpoint: str):
+        """
+        Consume the quota of the token.
+        :return: (allowed or not, rate-limit headers)
+        """
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            limit = self.limits.get(endpoint)
+            if limit is None:
+                return True, {}
+            now = time()
+            remaining, reset = self.buckets.get((token, endpoint), (limit, now + self.window))
+            if reset <= now:
+                remaining, reset = limit, now + self.window
+            allowed = remaining > 0 and not (self.error_rate > 0 and self.random.random() < self.error_rate)
+            if allowed:
+                remaining -= 1
+            self.buckets[(token, endpoint)] = (remaining, reset)
+        return allowed, {'x-rate-limit-limit': str(limit), 'x-rate-limit-remaining': str(remaining),
+                         # Rounded up, the window has been refreshed once the reset time has passed
+                         'x-rate-limit-reset': str(int(math.ceil(reset)))}
+
+    def _media_url(self, name: str):
+        return '{}/media/{}'.format(self.url, name)
+
+    def _rewrite(self, body: bytes) -> bytes:
+        # Media urls may be escaped as `https:\/\/pbs.twimg.com`
+        for host in MEDIA_HOSTS:
+            for scheme in ('https', 'http'):
+                body = body.replace('{}://{}'.format(scheme, host).encode(),
+                                    '{}/media/{}'.format(self.url, host).encode())
+                body = body.replace('{}:\\/\\/{}'.format(scheme, host).encode(),
+                                    '{}/media/{}'.format(self.url, host).replace('/', '\\/').encode())
+        return body
+
+    def _key(self, path: str, query: dict):
+        query = sorted((k, v) for k, v in query.items())
+        return hashlib.sha1(json.dumps([path, query]).encode()).hexdigest()
+
+    def _record(self, path: str, query: dict, headers: dict):
+        """
+        Forward the request to the upstream and save the response.
+        :return: (status, headers, body)
+        """
+        r = requests.get(self.upstream + path, params=query, headers=headers)
+        headers = dict((k.lower(), v) for k, v in r.headers.items() if k.lower().startswith('x-rate-limit'))
+        key = self._key(path, query)
+        with open(os.path.join(self.path, key + '.json'), 'w', encoding='utf-8') as f:
+            json.dump({'path': path, 'query': query, 'status': r.status_code, 'headers': headers}, f)
+        with open(os.path.join(self.path, key + '.body'), 'wb') as f:
+            f.write(r.content)
+        return r.status_code, headers, r.content
+
+    def _replay(self, path: str, query: dict):
+        key = self._key(path, query)
+        meta = os.path.join(self.path, key + '.json')
+        if not os.path.isfile(meta):
+            return 404, {}, b'{"errors": [{"code": 34, "message": "Not recorded."}]}'
+        with open(meta, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(os.path.join(self.path, key + '.body'), 'rb') as f:
+            return meta['status'], {}, f.read()
+
+    def _media(self, name: str):
+        """
+        :return: the content of the medium, or None if not found
+        """
+        if self.mode == 'synthetic':
+            size = self.video_size if name.endswith('.mp4') else self.media_size
+            block = hashlib.sha256(name.encode()).digest()
+            return (block * (size // len(block) + 1))[:size]
+        root = os.path.join(self.path, 'media')
+        path = os.path.abspath(os.path.join(root, *name.split('/')))
+        if os.path.commonpath([path, root]) != root:
+            return None
+        if not os.path.isfile(path) and self.mode == 'record':
+            r = requests.get('https://' + name)
+            if r.status_code != 200:
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(r.content)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    # Synthetic API
+
+    def _user(self, index: int):
+        user_id = USER_BASE + index
+        return {'id': user_id, 'id_str': str(user_id), 'name': 'User {}'.format(index),
+                'screen_name': 'user{}'.format(index), 'description': 'Synthetic user {}.'.format(index),
+                'followers_count': self.users - 1, 'friends_count': self.users - 1,
+                'statuses_count': self.tweets}
+
+    def _find_user(self, query: dict):
+        if 'user_id' in query:
+            index = int(query['user_id']) - USER_BASE
+        elif 'screen_name' in query and query['screen_name'].startswith('user'):
+            index = int(query['screen_name'][4:])
+        else:
+            return None
+        return index if 0 <= index < self.users else None
+
+    def _tweet(self, index: int, k: int, retweet: bool = True):
+        user = self._user(index)
+        tweet_id = user['id'] * TWEET_SPACE + k
+        tweet = {'id': tweet_id, 'id_str': str(tweet_id), 'text': 'Synthetic tweet {} of user {}.'.format(k, index),
+                 'created_at': 'Thu Jan 01 00:00:00 +0000 2020', 'user': user,
+                 'entities': {'hashtags': [], 'urls': [], 'user_mentions': []}}
+        if retweet and k % 5 == 0 and self.users > 1:
+            # Retweet the tweet with the same number of the next user
+            source = self._tweet((index + 1) % self.users, k, retweet=False)
+            tweet['retweeted_status'] = source
+            tweet['text'] = 'RT ' + source['text']
+            if 'extended_entities' in source:
+                tweet['extended_entities'] = source['extended_entities']
+        elif k % 3 == 1:
+            name = '{}.jpg'.format(tweet_id)
+            tweet['extended_entities'] = {'media': [
+                {'id': tweet_id, 'type': 'photo', 'media_url': self._media_url(name),
+                 'media_url_https': self._media_url(name)}]}
+        elif k % 3 == 2:
+            tweet['extended_entities'] = {'media': [
+                {'id': tweet_id, 'type': 'video', 'media_url': self._media_url('{}.jpg'.format(tweet_id)),
+                 'video_info': {'variants': [
+                     {'bitrate': 832000, 'content_type': 'video/mp4',
+                      'url': self._media_url('{}-832.mp4'.format(tweet_id))},
+                     {'bitrate': 2176000, 'content_type': 'video/mp4',
+                      'url': self._media_url('{}.mp4'.format(tweet_id))},
+                     {'content_type': 'application/x-mpegURL',
+                      'url': self._media_url('{}.m3u8'.format(tweet_id))}]}}]}
+        return tweet
+
+    def _find_tweet(self, tweet_id: int):
+        index, k = tweet_id // TWEET_SPACE - USER_BASE, tweet_id % TWEET_SPACE
+        if 0 <= index < self.users and 1 <= k <= self.tweets:
+            return self._tweet(index, k)
+        return None
+
+    def _tweets(self, index: int, query: dict):
+        count = min(int(query.get('count', 20)), 200)
+        base = (USER_BASE + index) * TWEET_SPACE
+        newest = self.tweets
+        if 'max_id' in query:
+            newest = min(newest, int(query['max_id']) - base)
+        oldest = 1
+        if 'since_id' in query:
+            oldest = max(oldest, int(query['since_id']) - base + 1)
+        return [self._tweet(index, k) for k in range(newest, max(oldest, newest - count + 1) - 1, -1)]
+
+    def _cursored(self, query: dict, maximum: int):
+        count = min(int(query.get('count', 20)), maximum)
+        cursor = int(query.get('cursor', -1))
+        start = 0 if cursor == -1 else cursor
+        end = min(start + count, self.users)
+        return start, end, end if end < self.users else 0
+
+    def _synthetic(self, endpoint: str, query: dict):
+        """
+        :return: (status, body object)
+        """
+        if endpoint in ('statuses/lookup.json', 'statuses/show.json'):
+            ids = [int(tweet_id) for tweet_id in query.get('id', '').split(',') if len(tweet_id) > 0]
+            tweets = [tweet for tweet in (self._find_tweet(tweet_id) for tweet_id in ids) if tweet is not None]
+            if endpoint == 'statuses/show.json':
+                return (200, tweets[0]) if len(tweets) > 0 else (404, _error(144, 'No status found with that ID.'))
+            return 200, tweets
+        if endpoint == 'users/lookup.json':
+            ids = [int(user_id) for user_id in query.get('user_id', '').split(',') if len(user_id) > 0]
+            return 200, [self._user(user_id - USER_BASE) for user_id in ids
+                         if 0 <= user_id - USER_BASE < self.users]
+        index = self._find_user(query)
+        if index is None:
+            return 404, _error(50, 'User not found.')
+        if endpoint == 'user/show.json':
+            return 200, self._user(index)
+        if endpoint == 'statuses/user_timeline.json':
+            return 200, self._tweets(index, query)
+        if endpoint == 'favorites/list.json':
+            # A user likes the tweets of the previous user
+            return 200, self._tweets((index - 1) % self.users, query)
+        if endpoint in ('friends/ids.json', 'friends/list.json', 'followers/ids.json', 'followers/list.json'):
+            ids = endpoint.endswith('ids.json')
+            start, end, next_cursor = self._cursored(query, 5000 if ids else 200)
+            # Every user follows all the others
+            others = [i for i in range(start, end) if i != index]
+            result = {'previous_cursor': 0, 'next_cursor': next_cursor, 'next_cursor_str': str(next_cursor)}
+            if ids:
+                result['ids'] = [USER_BASE + i for i in others]
+            else:
+                result['users'] = [self._user(i) for i in others]
+            return 200, result
+        return 404, _error(34, 'Sorry, that page does not exist.')
+
+
+def _error(code: int, message: str):
+    return {'errors': [{'code': code, 'message': message}]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head: bool = False):
+        mock = self.server.mock
+        if mock.latency > 0:
+            sleep(mock.latency)
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        if url.path.startswith('/media/'):
+            return self._media(mock, url.path[len('/media/'):], head)
+        if not url.path.startswith('/1.1/'):
+            return self._send(404, {}, json.dumps(_error(34, 'Sorry, that page does not exist.')).encode())
+        endpoint = url.path[len('/1.1/'):]
+        token = self.headers.get('Authorization', '')
+        allowed, headers = mock._limit(token, endpoint)
+        if not allowed:
+            return self._send(429, headers, json.dumps(_error(88, 'Rate limit exceeded')).encode())
+        if mock.mode == 'record':
+            status, recorded, body = mock._record(url.path, query, {'Authorization': token})
+            headers.update(recorded)
+        elif mock.mode == 'replay':
+            status, _, body = mock._replay(url.path, query)
+        else:
+            status, data = mock._synthetic(endpoint, query)
+            body = json.dumps(data).encode()
+        self._send(status, headers, mock._rewrite(body))
+
+    def _media(self, mock: MockTwitter, name: str, head: bool):
+        content = mock._media(name)
+        if content is None:
+            return self._send(404, {}, b'')
+        size = len(content)
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match is None:
+            return self._send(200, {'Accept-Ranges': 'bytes'}, content, head)
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        if start >= size or start > end:
+            return self._send(416, {'Content-Range': 'bytes */{}'.format(size)}, b'', head)
+        return self._send(206, {'Accept-Ranges': 'bytes', 'Content-Range': 'bytes {}-{}/{}'.format(start, end, size)},
+                          content[start:end + 1], head)
+
+    def _send(self, status: int, headers: dict, body: bytes, head: bool = False):
+        self.send_response(status)
+        content_type = 'application/octet-stream' if 'Accept-Ranges' in headers else 'application/json;charset=utf-8'
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
@@ -0,0 +1,168 @@
+import threading
+from queue import Queue
+from typing import Iterable, Union
+
+from spiderutil.log import Log
+
+from .checkpoint import Checkpoint, CheckpointWriter
+from .pool import DownloadPool, WORKERS, PER_HOST
+from .sink import Sink
+from .sync import SyncState
+from .tweet import Tweet
+from .twitter import TwitterDownloader
+from . import util
+
+QUEUE_SIZE = 1000
+BATCH_SIZE = 100
+
+_END = object()
+
+
+class Pipeline:
+    """
+    Crawl and download at the same time.
+
+    Tweets from the crawl generator are staged in batches and passed to a DownloadPool
+    through a bounded queue, so the crawler waits when the downloads fall behind.
+    Downloaded tweets are removed from the staging in batches, failed tweets are saved
+    into another collection. Crawls go from the newest tweet to the oldest, so the checkpoint
+    is moved to the newest tweet only after the crawl is exhausted and all its tweets are finished,
+    a crash in the middle leaves it where it was and the next session crawls the same range again.
+    The staging and failed collections could be `spiderutil.connector.MongoDB`
+    or anything with the same `insert`, `remove` and `all` methods.
+    Downloaded tweets are written into the sink, which is flushed once per batch.
+    The finished tweets are marked in the SyncState, so the high-water marks of a following crawl
+    are saved only after their tweets are finished.
+    """
+
+    def __init__(self, downloader: TwitterDownloader, staging=None, failed=None,
+                 checkpoint: Union[Checkpoint, CheckpointWriter] = None, checkpoint_path: str = None,
+                 workers: int = WORKERS, per_host: int = PER_HOST,
+                 queue_size: int = QUEUE_SIZE, batch_size: int = BATCH_SIZE,
+                 source: bool = True, sink: Sink = None, state: SyncState = None, logger=None):
+        """
+        :param downloader: TwitterDownloader, used to download the media
+        :param staging: collection to persist crawled tweets until they are downloaded
+        :param failed: collection to save the tweets failed to download
+        :param checkpoint: Checkpoint or CheckpointWriter, updated with the newest id once all the tweets are finished
+        :param checkpoint_path: str, where to save the checkpoint, not needed by CheckpointWriter
+        :param workers: int, the global limit of concurrent downloads
+        :param per_host: int, the limit of concurrent downloads to the same host
+        :param queue_size: int, the limit of tweets crawled but not downloaded yet
+        :param batch_size: int, count of tweets written or removed in one batch
+        :param source: bool, download the media of the source tweet (the original one of a retweet)
+        :param sink: Sink, where to keep the tweets downloaded successfully
+        :param state: SyncState, passed to `TwitterSpider.crawl_following` too
+        """
+        self.pool = DownloadPool(downloader, workers=workers, per_host=per_host)
+        self.staging = staging
+        self.failed = failed
+        self.checkpoint = checkpoint
+        self.checkpoint_path = checkpoint_path
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.source = source
+        self.sink = sink
+        self.state = state
+        self.logger = Log.create_logger('TwitterSpider', './twitter.log') if logger is None else logger
+
+    def run(self, tweets: Iterable[Tweet], resume: bool = False) -> int:
+        """
+        Crawl and download all the tweets.
+        :param tweets: iterable list of tweet objects, e.g. the generator of `TwitterSpider.crawl_timeline`
+        :param resume: bool, download the tweets left in the staging by the former session first
+        :return: int, count of tweets finished
+        """
+        queue = Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        errors = []
+        left = [Tweet(data) for data in self.staging.all()] if resume and self.staging is not None else []
+        if len(left) > 0:
+            self.logger.info('Resume %d tweets from the staging.', len(left))
+
+        crawler = threading.Thread(target=self._crawl, args=(tweets, left, queue, stop, errors), daemon=True)
+        crawler.start()
+        count, newest = 0, None
+        done, failed = [], []
+        try:
+            for tweet, error in self.pool.download(self._consume(queue), source=self.source):
+                if error is not None:
+                    self.logger.error('Cannot download %s: %s', tweet.id, error)
+                    failed.append(tweet)
+                done.append(tweet)
+                count += 1
+                if newest is None or tweet.id > newest:
+                    newest = tweet.id
+                if len(done) >= self.batch_size:
+                    self._finish(done, failed)
+                    done, failed = [], []
+        finally:
+            stop.set()
+            self._finish(done, failed)
+        crawler.join()
+        if len(errors) > 0:
+            raise errors[0]
+        # Every tweet older than the newest one has been crawled and finished
+        if self.checkpoint is not None and newest is not None:
+            self.checkpoint.update(tweet_id=newest)
+            if self.checkpoint_path is not None:
+                self.checkpoint.save(self.checkpoint_path)
+        return count
+
+    def _crawl(self, tweets: Iterable[Tweet], left: list, queue: Queue, stop: threading.Event, errors: list):
+        # Waits for the rate limit are cut short once the downloading is stopped
+        util.interruptible(stop)
+        for tweet in left:
+            if not util.put(queue, tweet, stop):
+                return
+        batch = []
+        try:
+            for tweet in tweets:
+                batch.append(tweet)
+                if len(batch) >= self.batch_size:
+                    if not self._stage(batch, queue, stop):
+                        return
+                    batch = []
+            self._stage(batch, queue, stop)
+        except Exception as e:
+            if not stop.is_set():
+                self.logger.error('Crawling failed: %s', e)
+                errors.append(e)
+        finally:
+            util.put(queue, _END, stop)
+
+    def _stage(self, batch: list, queue: Queue, stop: threading.Event) -> bool:
+        if len(batch) <= 0:
+            return True
+        # Persist the batch before downloading, so it is not lost if the session crashed
+        # Copies are inserted, insert_many adds `_id` into the documents
+        if self.staging is not None:
+            self.staging.insert([dict(tweet.dict) for tweet in batch])
+        for tweet in batch:
+            if not util.put(queue, tweet, stop):
+                return False
+        return True
+
+    @staticmethod
+    def _consume(queue: Queue) -> Iterable[Tweet]:
+        while True:
+            tweet = queue.get()
+            if tweet is _END:
+                return
+            yield tweet
+
+    def _finish(self, done: list, failed: list):
+        if len(done) <= 0:
+            return
+        if self.failed is not None and len(failed) > 0:
+            self.failed.insert([dict(tweet.dict) for tweet in failed])
+        if self.sink is not None:
+            failed_ids = set(tweet.id for tweet in failed)
+            self.sink.write_all(tweet for tweet in done if tweet.id not in failed_ids)
+            self.sink.flush()
+        if self.staging is not None:
+            self.staging.remove({'id': {'$in': [tweet.id for tweet in done]}}, all=True)
+        if self.state is not None:
+            for tweet in done:
+                self.state.mark(tweet.id)
+        self.logger.info('Finished %d tweets, %d failed.', len(done), len(failed))
@@ -0,0 +1,131 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterable
+
+from requests.adapters import HTTPAdapter, DEFAULT_POOLBLOCK, DEFAULT_POOLSIZE, DEFAULT_RETRIES
+
+from .tweet import Tweet
+from .twitter import TwitterDownloader
+
+if sys.version_info[0] > 2:
+    import urllib.parse as urlparse
+else:
+    import urlparse
+
+WORKERS = 8
+PER_HOST = 4
+
+
+class DownloadPool:
+    """
+    Download the media of a stream of tweets concurrently.
+    Return the (tweet, error) pair of every tweet once all its media are finished,
+    error is None if the tweet is downloaded successfully.
+    """
+
+    def __init__(self, downloader: TwitterDownloader, workers: int = WORKERS, per_host: int = PER_HOST,
+                 queue_size: int = None):
+        """
+        :param downloader: TwitterDownloader, used to generate paths and fetch the media
+        :param workers: int, the global limit of concurrent downloads
+        :param per_host: int, the limit of concurrent downloads to the same host
+        :param queue_size: int, the limit of media waiting in the pool, default is 4 times of workers
+
+        The default adapters of the session of the downloader are replaced with ones of enough connections
+        for the workers, adapters mounted by the caller, e.g. with retries or TLS settings, are kept as they are.
+        """
+        self.downloader = downloader
+        self.workers = workers
+        self.per_host = per_host
+        self.queue_size = queue_size if queue_size is not None else workers * 4
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+        # Keep enough connections alive for every worker, and every range of a large file
+        session = getattr(downloader.session, 'session', None)
+        if session is not None:
+            segments = max(getattr(downloader, 'segments', 1), 1)
+            adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=max(workers, per_host) * segments)
+            for prefix in ('http://', 'https://'):
+                if _default_adapter(session.adapters.get(prefix)):
+                    session.mount(prefix, adapter)
+
+    def _host(self, url) -> threading.BoundedSemaphore:
+        host = urlparse.urlparse(url).netloc
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self.hosts[host]
+
+    def _fetch(self, medium, path):
+        with self._host(medium.url):
+            return self.downloader.fetch(medium.url, path, media_id=medium.id)
+
+    def download(self, tweets: Iterable[Tweet], source: bool = False):
+        """
+        :param tweets: iterable list of tweet objects
+        :param source: bool, download the media of the source tweet (the original one of a retweet)
+                       instead, the tweet itself is still returned
+        :return: iterable list of (tweet, error)
+        """
+        pending = {}
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            for tweet in tweets:
+                job = _Job(tweet, tweet.source if source else tweet)
+                try:
+                    tasks = list(self.downloader.tasks(job.target))
+                except Exception as e:
+                    yield tweet, e
+                    continue
+                if len(tasks) <= 0:
+                    self.downloader.mark(job.target)
+                    yield tweet, None
+                    continue
+                job.pending = len(tasks)
+                for medium, path in tasks:
+                    pending[executor.submit(self._fetch, medium, path)] = job
+                # Backpressure, wait until the pool is not full
+                while len(pending) >= self.queue_size:
+                    for result in self._collect(pending, FIRST_COMPLETED):
+                        yield result
+            while len(pending) > 0:
+                for result in self._collect(pending, FIRST_COMPLETED):
+                    yield result
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _collect(self, pending: dict, return_when):
+        done, _ = wait(list(pending.keys()), return_when=return_when)
+        for future in done:
+            job = pending.pop(future)
+            error = future.exception()
+            if error is not None:
+                self.downloader.logger.error('Failed to download %s: %s', job.tweet.id, error)
+                if job.error is None:
+                    job.error = error
+            job.pending -= 1
+            if job.pending <= 0:
+                if job.error is None:
+                    self.downloader.mark(job.target)
+                yield job.tweet, job.error
+
+
+class _Job:
+
+    def __init__(self, tweet: Tweet, target: Tweet):
+        self.tweet = tweet
+        # The tweet whose media are downloaded, the source of a retweet or the tweet itself
+        self.target = target
+        self.pending = 0
+        self.error = None
+
+
+def _default_adapter(adapter) -> bool:
+    """
+    :return: bool, the adapter is the one mounted by `requests.Session`, i.e. not configured by the caller
+    """
+    return type(adapter) is HTTPAdapter and adapter.max_retries.total == DEFAULT_RETRIES \
+        and adapter._pool_connections == DEFAULT_POOLSIZE and adapter._pool_maxsize == DEFAULT_POOLSIZE \
+        and adapter._pool_block == DEFAULT_POOLBLOCK
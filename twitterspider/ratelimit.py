@@ -0,0 +1,200 @@
+import threading
+from time import sleep, time
+
+WINDOW = 15 * 60
+# The reset header is in whole seconds, wait a little longer to be sure the window is refreshed
+MARGIN = 1.0
+# Wait after a 429 whose reset time has passed already
+BACKOFF = 5.0
+
+
+class RateLimit:
+    """
+    State of a single rate-limit bucket (one endpoint of one token).
+    """
+
+    def __init__(self, limit: int = None, remaining: int = None, reset: float = None):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        # The earliest time the next request is scheduled at
+        self.next = 0.0
+
+
+class RateLimiter:
+    """
+    Per-endpoint request governor driven by the `x-rate-limit-*` response headers.
+
+    Before every request call `reserve` (or `wait`) with the endpoint,
+    after every response call `update` with the response headers.
+    The remaining quota is spread evenly over the rest of the window,
+    and the limiter blocks until the reset time once the quota is gone.
+    """
+
+    def __init__(self, window: float = WINDOW, spread: bool = True, margin: float = MARGIN,
+                 backoff: float = BACKOFF):
+        """
+        :param window: float, length of the rate-limit window in seconds, used when the reset time is unknown
+        :param spread: bool, spread the remaining quota over the window, otherwise only block when it is gone
+        :param margin: float, seconds added to the reset time of the headers
+        :param backoff: float, seconds to wait after a 429 if the known reset time has passed
+        """
+        self.window = window
+        self.spread = spread
+        self.margin = margin
+        self.backoff = backoff
+        self.limits = {}
+        self.lock = threading.Lock()
+
+    def reserve(self, endpoint: str) -> float:
+        """
+        Reserve a request slot of the endpoint.
+        :param endpoint: str, the key of the rate-limit bucket
+        :return: float, seconds to wait before the request could be sent
+        """
+        with self.lock:
+            now = time()
+            bucket = self.limits.get(endpoint)
+            if bucket is None or bucket.remaining is None or bucket.reset is None:
+                return 0.0
+            if bucket.reset <= now:
+                # The window has been refreshed, the quota is unknown until the next response
+                bucket.remaining = None
+                bucket.next = 0.0
+                return 0.0
+            if bucket.remaining <= 0:
+                # Every request waits for the new window, the quota is cleared once the reset time has passed
+                return bucket.reset - now
+            start = max(now, bucket.next)
+            if self.spread:
+                bucket.next = start + (bucket.reset - start) / bucket.remaining
+            bucket.remaining -= 1
+            return start - now
+
+    def delay(self, endpoint: str) -> float:
+        """
+        Peek the seconds to wait before a request of the endpoint could be sent, without reserving it.
+        """
+        with self.lock:
+            now = time()
+            bucket = self.limits.get(endpoint)
+            if bucket is None or bucket.remaining is None or bucket.reset is None or bucket.reset <= now:
+                return 0.0
+            if bucket.remaining <= 0:
+                return bucket.reset - now
+            return max(0.0, bucket.next - now)
+
+    def wait(self, endpoint: str) -> float:
+        """
+        Reserve a request slot and block until it could be used.
+        :return: float, seconds slept
+        """
+        delay = self.reserve(endpoint)
+        if delay > 0:
+            sleep(delay)
+        return delay
+
+    def update(self, endpoint: str, headers):
+        """
+        Refresh the bucket of the endpoint with the headers of a response.
+        :param endpoint: str, the key of the rate-limit bucket
+        :param headers: the headers of the response
+        """
+        try:
+            limit = int(headers['x-rate-limit-limit']) if 'x-rate-limit-limit' in headers else None
+            remaining = int(headers['x-rate-limit-remaining'])
+            reset = float(headers['x-rate-limit-reset']) + self.margin
+        except (KeyError, ValueError, TypeError):
+            return
+        with self.lock:
+            bucket = self.limits.get(endpoint)
+            if bucket is None:
+                self.limits[endpoint] = RateLimit(limit, remaining, reset)
+            elif bucket.reset is None or bucket.remaining is None or reset > bucket.reset:
+                # A new window
+                bucket.limit, bucket.remaining, bucket.reset = limit, remaining, reset
+            else:
+                # Responses may arrive out of order, the smaller quota is the truth
+                bucket.limit = limit
+                bucket.remaining = min(bucket.remaining, remaining)
+
+    def exhaust(self, endpoint: str, reset: float = None):
+        """
+        Mark the quota of the endpoint as gone, e.g. after a 429 response.
+        :param endpoint: str, the key of the rate-limit bucket
+        :param reset: float, epoch time when the quota is refreshed, default is the known reset time,
+                      a short backoff if it has passed, or the end of a whole window if it is unknown
+        """
+        with self.lock:
+            now = time()
+            bucket = self.limits.setdefault(endpoint, RateLimit())
+            if reset is None:
+                if bucket.reset is None:
+                    reset = now + self.window
+                elif bucket.reset > now:
+                    reset = bucket.reset
+                else:
+                    # Limited right at the boundary of the window, the next window is about to begin
+                    reset = now + self.backoff
+            bucket.remaining = 0
+            bucket.reset = reset
+
+    def remaining(self, endpoint: str):
+        """
+        :return: the known remaining quota of the endpoint, or None if unknown
+        """
+        with self.lock:
+            bucket = self.limits.get(endpoint)
+            if bucket is None or bucket.reset is None or bucket.reset <= time():
+                return None
+            return bucket.remaining
+
+
+class TokenPool:
+    """
+    Pool of API tokens, each token has its own rate limit of every endpoint.
+    Every request goes to the token which could send it the soonest,
+    so the throughput grows with the count of tokens.
+    """
+
+    def __init__(self, tokens, limiter: RateLimiter = None):
+        """
+        :param tokens: list of tokens, or a single token
+        :param limiter: RateLimiter, keyed by (token, endpoint)
+        """
+        self.tokens = [tokens] if isinstance(tokens, str) else list(tokens)
+        if len(self.tokens) <= 0:
+            raise ValueError('At least one token is required.')
+        self.limiter = RateLimiter() if limiter is None else limiter
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def acquire(self, endpoint: str):
+        """
+        Choose a token for the endpoint and reserve a request slot of it.
+        :return: (token, seconds to wait before the request could be sent)
+        """
+        with self.lock:
+            token = min(self.tokens, key=lambda t: self._rank(t, endpoint))
+            return token, self.limiter.reserve((token, endpoint))
+
+    def _rank(self, token: str, endpoint: str):
+        remaining = self.limiter.remaining((token, endpoint))
+        # Prefer the token could be used the soonest, then the one with more (or unknown) quota
+        return self.limiter.delay((token, endpoint)), -remaining if remaining is not None else -float('inf')
+
+    def update(self, token: str, endpoint: str, headers):
+        self.limiter.update((token, endpoint), headers)
+
+    def exhaust(self, token: str, endpoint: str, reset: float = None):
+        self.limiter.exhaust((token, endpoint), reset)
+
+    def remaining(self, endpoint: str):
+        """
+        :return: the known remaining quota of the endpoint summed over all tokens, or None if unknown
+        """
+        quotas = [self.limiter.remaining((token, endpoint)) for token in self.tokens]
+        quotas = [quota for quota in quotas if quota is not None]
+        return sum(quotas) if len(quotas) > 0 else None
@@ -0,0 +1,211 @@
+import threading
+from collections import deque
+from queue import Queue
+from typing import Iterable
+
+from spiderutil.log import Log
+
+from .sync import SyncState
+from .twitter import TwitterSpider
+from . import util
+
+QUEUE_SIZE = 1000
+
+TIMELINE = 'timeline'
+LIKES = 'likes'
+FOLLOWING = 'following'
+
+_END = object()
+
+
+class CrawlJob:
+    """
+    A timeline, likes or following crawl of one user, see `CrawlScheduler`.
+    """
+
+    def __init__(self, kind: str, screen_name: str = None, user_id=None, parent=None, **kwargs):
+        """
+        :param kind: str, `timeline`, `likes` or `following`
+        :param parent: CrawlJob, the following job which this job is expanded from
+        :param kwargs: other parameters of the crawl method
+        """
+        if kind not in (TIMELINE, LIKES, FOLLOWING):
+            raise ValueError('Unknown job {}.'.format(kind))
+        if screen_name is None and user_id is None:
+            raise ValueError('User ID or username is required.')
+        self.kind = kind
+        self.screen_name = screen_name
+        self.user_id = user_id
+        self.parent = parent
+        self.kwargs = kwargs
+        self.count = 0
+        self.newest = None
+        self.error = None
+
+    def __repr__(self):
+        return 'CrawlJob({}, {})'.format(self.kind, self.user_id if self.user_id is not None else self.screen_name)
+
+
+class CrawlScheduler:
+    """
+    Run many crawl jobs at the same time, the results stream out through one iterator.
+
+    The rate limit is separate for every endpoint, so every kind of job has its own workers,
+    and the timelines keep being crawled while the likes are waiting for their small quota.
+
+        scheduler = CrawlScheduler(spider)
+        scheduler.likes(screen_name='twitter')
+        scheduler.following(screen_name='twitter', likes=True)
+        for job, tweet in scheduler.run():
+            ...
+
+    A following job enumerates the ids of the users followed and adds a timeline
+    (and optionally a likes) job of every user. Failed jobs are logged and kept in `failed`.
+    """
+
+    def __init__(self, spider: TwitterSpider, workers: int = 1, queue_size: int = QUEUE_SIZE,
+                 state: SyncState = None, logger=None):
+        """
+        :param spider: TwitterSpider, used to crawl, its rate limiter is shared by all the jobs
+        :param workers: int, count of workers of every endpoint, more workers help when
+                        there are many tokens and a single worker could not use up their quota
+        :param queue_size: int, the limit of tweets crawled but not consumed yet
+        :param state: SyncState, only crawl the tweets newer than the ones crawled before
+                      in the timeline jobs, the newest id is saved once a job is consumed
+        """
+        self.spider = spider
+        self.workers = workers
+        self.queue = Queue(maxsize=queue_size)
+        self.state = state
+        self.logger = Log.create_logger('TwitterSpider', './twitter.log') if logger is None else logger
+        self.lanes = {kind: deque() for kind in (TIMELINE, LIKES, FOLLOWING)}
+        self.condition = threading.Condition()
+        self.pending = 0
+        self.stop = threading.Event()
+        self.failed = []
+
+    def add(self, job: CrawlJob) -> CrawlJob:
+        """
+        Add a job, it could be called while the scheduler is running.
+        """
+        if job.kind == TIMELINE and self.state is not None and job.user_id is not None \
+                and 'since_id' not in job.kwargs:
+            job.kwargs['since_id'] = self.state.get(job.user_id)
+        with self.condition:
+            self.lanes[job.kind].append(job)
+            self.pending += 1
+            self.condition.notify_all()
+        return job
+
+    def timeline(self, screen_name: str = None, user_id=None, **kwargs) -> CrawlJob:
+        """
+        :param kwargs: other parameters of `TwitterSpider.crawl_timeline`
+        """
+        return self.add(CrawlJob(TIMELINE, screen_name=screen_name, user_id=user_id, **kwargs))
+
+    def likes(self, screen_name: str = None, user_id=None, **kwargs) -> CrawlJob:
+        """
+        :param kwargs: other parameters of `TwitterSpider.crawl_likes`
+        """
+        return self.add(CrawlJob(LIKES, screen_name=screen_name, user_id=user_id, **kwargs))
+
+    def following(self, screen_name: str = None, user_id=None, timelines: bool = True, likes: bool = False,
+                  **kwargs) -> CrawlJob:
+        """
+        :param timelines: bool, add a timeline job of every user followed
+        :param likes: bool, add a likes job of every user followed
+        :param kwargs: other parameters of the timeline jobs, e.g. include_retweets
+        """
+        return self.add(CrawlJob(FOLLOWING, screen_name=screen_name, user_id=user_id,
+                                 timelines=timelines, likes=likes, **kwargs))
+
+    def run(self) -> Iterable[tuple]:
+        """
+        Run all the jobs until they are finished, including the jobs expanded from the following jobs.
+        :return: iterable list of (job, tweet)
+        """
+        if self.pending <= 0:
+            return
+        self.stop.clear()
+        threads = [threading.Thread(target=self._work, args=(kind,), daemon=True)
+                   for kind in self.lanes for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _END:
+                    return
+                job, tweet = item
+                if tweet is None:
+                    self._finish(job)
+                    continue
+                yield job, tweet
+        finally:
+            self.stop.set()
+            with self.condition:
+                self.condition.notify_all()
+            for thread in threads:
+                thread.join()
+
+    def _work(self, kind: str):
+        # Waits for the rate limit are cut short once the consumer is gone
+        util.interruptible(self.stop)
+        lane = self.lanes[kind]
+        while True:
+            with self.condition:
+                while len(lane) <= 0 and self.pending > 0 and not self.stop.is_set():
+                    self.condition.wait()
+                if len(lane) <= 0 or self.stop.is_set():
+                    return
+                job = lane.popleft()
+            try:
+                self._crawl(job)
+            except Exception as e:
+                if not self.stop.is_set():
+                    self.logger.error('Job %s failed: %s', job, e)
+                    job.error = e
+                    self.failed.append(job)
+            with self.condition:
+                self.pending -= 1
+                finished = self.pending <= 0
+                self.condition.notify_all()
+            if finished:
+                self._put(_END)
+
+    def _crawl(self, job: CrawlJob):
+        if job.kind == FOLLOWING:
+            kwargs = dict(job.kwargs)
+            timelines, likes = kwargs.pop('timelines'), kwargs.pop('likes')
+            for following_id in self.spider.crawl_following_ids(screen_name=job.screen_name,
+                                                                user_id=job.user_id):
+                if self.stop.is_set():
+                    return
+                if timelines:
+                    self.add(CrawlJob(TIMELINE, user_id=following_id, parent=job, **kwargs))
+                if likes:
+                    self.add(CrawlJob(LIKES, user_id=following_id, parent=job))
+                job.count += 1
+            return
+        crawl = self.spider.crawl_timeline if job.kind == TIMELINE else self.spider.crawl_likes
+        tweets = crawl(screen_name=job.screen_name, user_id=job.user_id, **job.kwargs)
+        try:
+            for tweet in tweets:
+                if job.newest is None or tweet.id > job.newest:
+                    job.newest = tweet.id
+                job.count += 1
+                if not self._put((job, tweet)):
+                    return
+        finally:
+            tweets.close()
+        # Mark the end of the job, handled once the consumer has got all its tweets
+        self._put((job, None))
+
+    def _finish(self, job: CrawlJob):
+        self.logger.info('Job %s finished with %d tweets.', job, job.count)
+        if job.kind == TIMELINE and self.state is not None and job.user_id is not None \
+                and job.newest is not None:
+            self.state.set(job.user_id, job.newest)
+
+    def _put(self, item) -> bool:
+        return util.put(self.queue, item, self.stop)
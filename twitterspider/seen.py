@@ -0,0 +1,246 @@
+import math
+import os
+import sqlite3
+import struct
+import threading
+from typing import Iterable
+
+CAPACITY = 1000000
+ERROR_RATE = 0.001
+BATCH_SIZE = 1000
+
+# Size of the bit array, count of hashes, count of ids
+HEADER = struct.Struct('<QQQ')
+MASK = (1 << 64) - 1
+
+
+class SeenSet:
+    """
+    Persistent set of tweet ids, used to drop the tweets crawled or downloaded before.
+
+    Ids are kept in a SQLite table, with a Bloom filter in memory in front of it,
+    so an id never seen is told without touching the disk, and a hit of the filter is
+    confirmed by the table, there is no false positive.
+    The filter is saved into `<path>.bloom` on close and rebuilt from the table if it is
+    missing or stale, e.g. the session crashed, or larger than the capacity.
+
+    The crawls only check the set, the tweets are added by `mark` once they are handled,
+    e.g. by `TwitterDownloader` after they are downloaded, so the tweets crawled but not
+    handled before a crash are crawled again:
+
+        seen = SeenSet('./seen.db')
+        downloader = TwitterDownloader('./download', seen=seen)
+        for tweet in spider.crawl_likes(screen_name='twitter', seen=seen):
+            downloader.download(tweet)
+    """
+
+    def __init__(self, path: str = './seen.db', capacity: int = CAPACITY, error_rate: float = ERROR_RATE,
+                 batch_size: int = BATCH_SIZE):
+        """
+        :param path: str, path of the SQLite file
+        :param capacity: int, expected count of ids, the filter grows once it is exceeded
+        :param error_rate: float, false positive rate of the filter, which costs a query of the table
+        :param batch_size: int, count of ids inserted into the table in one transaction
+        """
+        self.path = os.path.abspath(path)
+        self.bloom_path = self.path + '.bloom'
+        self.error_rate = error_rate
+        self.batch_size = batch_size
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS seen (id INTEGER PRIMARY KEY)')
+            # Walks of the crawls stopped at a known page, see `begin`
+            self.conn.execute('CREATE TABLE IF NOT EXISTS walks (key TEXT PRIMARY KEY, complete INTEGER, '
+                              'last_id INTEGER, source_id INTEGER)')
+        self.count = self.conn.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+        self.capacity = max(capacity, self.count * 2)
+        if not self._load():
+            self._rebuild()
+
+    def _size(self):
+        # Optimal size of the bit array and count of hashes for the capacity and the error rate
+        bits = int(math.ceil(-self.capacity * math.log(self.error_rate) / math.log(2) ** 2))
+        return bits, max(1, int(round(bits / self.capacity * math.log(2))))
+
+    def _load(self) -> bool:
+        if not os.path.isfile(self.bloom_path):
+            return False
+        with open(self.bloom_path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return False
+            bits, hashes, count = HEADER.unpack(header)
+            if count != self.count or bits < self._size()[0]:
+                return False
+            self.bits, self.hashes = bits, hashes
+            self.filter = bytearray(f.read())
+        return len(self.filter) == (self.bits + 7) // 8
+
+    def _rebuild(self):
+        self.bits, self.hashes = self._size()
+        self.filter = bytearray((self.bits + 7) // 8)
+        for row in self.conn.execute('SELECT id FROM seen'):
+            self._set(row[0])
+
+    def _positions(self, key: int):
+        # Double hashing of the mixed 64-bit key (splitmix64)
+        h = (key + 0x9e3779b97f4a7c15) & MASK
+        h = ((h ^ (h >> 30)) * 0xbf58476d1ce4e5b9) & MASK
+        h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & MASK
+        h ^= h >> 31
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def _set(self, key: int):
+        for position in self._positions(key):
+            self.filter[position >> 3] |= 1 << (position & 7)
+
+    def _test(self, key: int) -> bool:
+        for position in self._positions(key):
+            if not self.filter[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def _contains(self, key: int) -> bool:
+        if not self._test(key):
+            return False
+        if key in self.pending:
+            return True
+        return self.conn.execute('SELECT 1 FROM seen WHERE id = ?', (key,)).fetchone() is not None
+
+    def __contains__(self, key) -> bool:
+        key = int(key)
+        with self.lock:
+            return self._contains(key)
+
+    def add(self, key) -> bool:
+        """
+        :return: bool, True if the id is new, False if it has been seen
+        """
+        key = int(key)
+        with self.lock:
+            if self._contains(key):
+                return False
+            self._set(key)
+            self.pending.add(key)
+            self.count += 1
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+            if self.count > self.capacity:
+                self._flush()
+                self.capacity *= 2
+                self._rebuild()
+            return True
+
+    def add_all(self, keys: Iterable) -> int:
+        """
+        :return: int, count of the ids new
+        """
+        return sum(1 for key in keys if self.add(key))
+
+    def seen(self, tweet: dict) -> bool:
+        """
+        Check the id of the tweet and the id of its source (the original one of a retweet),
+        both are added, a tweet is new only if neither of them has been seen.
+        :param tweet: dict of the tweet
+        :return: bool, True if the tweet or its source has been seen
+        """
+        new = self.add(tweet['id'])
+        source = _source_id(tweet)
+        if source is not None:
+            new = self.add(source) and new
+        return not new
+
+    def known(self, tweet: dict) -> bool:
+        """
+        Check the id of the tweet and the id of its source without adding them.
+        :param tweet: dict of the tweet
+        :return: bool, True if the tweet or its source has been added
+        """
+        if tweet['id'] in self:
+            return True
+        source = _source_id(tweet)
+        return source is not None and source in self
+
+    def mark(self, tweet: dict):
+        """
+        Add the id of the tweet and the id of its source, once the tweet is handled, see `known`.
+        :param tweet: dict of the tweet
+        """
+        self.add(tweet['id'])
+        source = _source_id(tweet)
+        if source is not None:
+            self.add(source)
+
+    def begin(self, key: str) -> bool:
+        """
+        Start a walk of a list crawled newest first, e.g. the likes of a user.
+        The walk could stop at a page already known only if the former walk reached the end
+        and the last tweet of it has been marked, otherwise the tweets crawled but not handled
+        in the former session are behind the known pages.
+        :param key: str, the key of the list
+        :return: bool, True if the walk could stop at a known page
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT complete, last_id, source_id FROM walks WHERE key = ?',
+                                    (key,)).fetchone()
+            with self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO walks VALUES (?, 0, NULL, NULL)', (key,))
+            if row is None or not row[0]:
+                return False
+            return row[1] is None or any(i is not None and self._contains(i) for i in row[1:])
+
+    def end(self, key: str, tweet: dict = None):
+        """
+        Record the walk as complete.
+        :param tweet: dict of the last tweet yielded by the walk, None if nothing was yielded
+        """
+        last_id, source_id = (tweet['id'], _source_id(tweet)) if tweet is not None else (None, None)
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO walks VALUES (?, 1, ?, ?)', (key, last_id, source_id))
+
+    def __len__(self):
+        return self.count
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if len(self.pending) <= 0:
+            return
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO seen VALUES (?)', [(key,) for key in self.pending])
+        self.pending = set()
+
+    def save(self):
+        """
+        Commit the ids and save the filter atomically.
+        """
+        with self.lock:
+            self._flush()
+            temp = self.bloom_path + '.tmp'
+            with open(temp, 'wb') as f:
+                f.write(HEADER.pack(self.bits, self.hashes, self.count))
+                f.write(self.filter)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.bloom_path)
+
+    def close(self):
+        self.save()
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _source_id(tweet: dict):
+    source = tweet.get('retweeted_status')
+    return source['id'] if isinstance(source, dict) and 'id' in source else None
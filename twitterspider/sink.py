@@ -0,0 +1,206 @@
+import bz2
+import gzip
+import json
+import lzma
+import os
+import sqlite3
+import threading
+from time import time
+from typing import Iterable, Union
+
+from .tweet import Tweet
+
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 5
+
+COMPRESSIONS = {
+    'gzip': gzip.open,
+    'bz2': bz2.open,
+    'xz': lzma.open,
+}
+EXTENSIONS = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+}
+
+
+class Sink:
+    """
+    Destination of crawled tweets, which are buffered and written in batches.
+    A batch is written once it is full, or when a tweet is written and the former batch
+    is older than the flush interval.
+
+        with JSONLinesSink('./tweets.jsonl.gz') as sink:
+            for tweet in sink.tap(spider.crawl_timeline(screen_name='twitter')):
+                ...
+
+    Subclasses implement `_write` with a whole batch.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        """
+        :param batch_size: int, count of tweets written in one batch
+        :param flush_interval: float, the limit of seconds a tweet stays in the buffer, None to disable
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.flushed = time()
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, tweet: Union[Tweet, dict]):
+        """
+        :param tweet: Tweet or the dict of a tweet
+        """
+        data = tweet.dict if isinstance(tweet, Tweet) else tweet
+        if '_id' in data:
+            # Documents from MongoDB, e.g. the tweets resumed from the staging, the ObjectId is not kept
+            data = dict(data)
+            del data['_id']
+        with self.lock:
+            self.buffer.append(data)
+            if len(self.buffer) >= self.batch_size or \
+                    (self.flush_interval is not None and time() - self.flushed >= self.flush_interval):
+                self._flush()
+
+    def write_all(self, tweets: Iterable[Union[Tweet, dict]]):
+        for tweet in tweets:
+            self.write(tweet)
+
+    def tap(self, tweets: Iterable[Tweet]) -> Iterable[Tweet]:
+        """
+        Write every tweet of the crawl generator and pass it through.
+        :return: iterable list of tweet objects
+        """
+        for tweet in tweets:
+            self.write(tweet)
+            yield tweet
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.flushed = time()
+        if len(self.buffer) <= 0:
+            return
+        batch, self.buffer = self.buffer, []
+        self._write(batch)
+        self.count += len(batch)
+
+    def _write(self, batch: list):
+        raise NotImplementedError()
+
+    def close(self):
+        self.flush()
+
+
+class MongoSink(Sink):
+    """
+    Write the tweets into MongoDB, one `insert_many` per batch.
+    """
+
+    def __init__(self, collection, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        """
+        :param collection: `spiderutil.connector.MongoDB`, or the name of the collection
+        """
+        super().__init__(batch_size, flush_interval)
+        if type(collection) is str:
+            from spiderutil.connector import MongoDB
+            collection = MongoDB(collection)
+        self.collection = collection
+
+    def _write(self, batch: list):
+        # insert_many adds `_id` into the documents, keep the dict of the tweets clean
+        self.collection.insert([dict(tweet) for tweet in batch])
+
+
+class SQLiteSink(Sink):
+    """
+    Write the tweets into SQLite, one transaction per batch.
+    Tweets are keyed by the id, a tweet written again replaces the former one.
+    """
+
+    def __init__(self, path: str = './tweets.db', table: str = 'tweets',
+                 batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        super().__init__(batch_size, flush_interval)
+        self.path = os.path.abspath(path)
+        self.table = table
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS {} ('
+                              'id INTEGER PRIMARY KEY, user_id INTEGER, created_at TEXT, data TEXT)'.format(table))
+
+    def _write(self, batch: list):
+        rows = [(tweet['id'], tweet.get('user', {}).get('id'), tweet.get('created_at'),
+                 json.dumps(tweet, ensure_ascii=False)) for tweet in batch]
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?)'.format(self.table), rows)
+
+    def all(self) -> Iterable[dict]:
+        """
+        :return: iterable list of the dict of all the tweets, newest first
+        """
+        for row in self.conn.execute('SELECT data FROM {} ORDER BY id DESC'.format(self.table)):
+            yield json.loads(row[0])
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM {}'.format(self.table)).fetchone()[0]
+
+    def close(self):
+        super().close()
+        with self.lock:
+            self.conn.close()
+
+
+class JSONLinesSink(Sink):
+    """
+    Append the tweets into a file of newline-delimited JSON, one write per batch.
+    """
+
+    def __init__(self, path: str = './tweets.jsonl', compression: str = None,
+                 batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        """
+        :param path: str, path of the file, appended if it exists
+        :param compression: str, `gzip`, `bz2` or `xz`, default is inferred from the extension of the path
+        """
+        super().__init__(batch_size, flush_interval)
+        self.path = os.path.abspath(path)
+        if compression is None:
+            compression = EXTENSIONS.get(os.path.splitext(path)[1])
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError('Unknown compression {}.'.format(compression))
+        self.compression = compression
+        opener = COMPRESSIONS[compression] if compression is not None else open
+        # Every append of a compressed file is a new stream, which is still readable as a whole
+        self.file = opener(self.path, 'at', encoding='utf-8')
+
+    def _write(self, batch: list):
+        self.file.write(''.join(json.dumps(tweet, ensure_ascii=False) + '\n' for tweet in batch))
+        self.file.flush()
+
+    def close(self):
+        super().close()
+        with self.lock:
+            self.file.close()
+
+    @staticmethod
+    def read(path: str, compression: str = None) -> Iterable[dict]:
+        """
+        :return: iterable list of the dict of the tweets in the file
+        """
+        if compression is None:
+            compression = EXTENSIONS.get(os.path.splitext(path)[1])
+        opener = COMPRESSIONS[compression] if compression is not None else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if len(line.strip()) > 0:
+                    yield json.loads(line)
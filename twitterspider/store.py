@@ -0,0 +1,89 @@
+import os
+import threading
+from typing import Union
+
+from spiderutil.path import PathGenerator
+from spiderutil.typing import MediaType
+
+
+class StoreByContent(PathGenerator):
+    """
+    Content-addressed store, every medium is stored only once.
+
+    The blob of a medium is named by its media id, e.g. `.blobs/89/1234567889.jpg`,
+    so the same medium reached from retweets, likes and timelines maps to one file.
+    The user of every tweet downloaded gets a view `[Username]/[Media ID].[Ext]`,
+    which is a hard link (or a symbolic link if hard links are not supported) to the blob.
+    The media of a retweet downloaded with `source=True` are the ones of the source tweet,
+    so only the author of the source tweet gets a view, not the user who retweeted it.
+    """
+
+    def __init__(self, folder_path: str, symlink: bool = False):
+        """
+        :param folder_path: str, the root of the store
+        :param symlink: bool, use symbolic links for views instead of hard links
+        """
+        PathGenerator.__init__(self, folder_path)
+        self.blob_path = self.join('.blobs')
+        self.check(self.blob_path)
+        self.symlink = symlink
+        # Views waiting for their blob to be downloaded
+        self.views = {}
+        self.lock = threading.Lock()
+
+    def generate(self, media_id, media_type: Union[str, MediaType], screen_name: str = None, **kwargs):
+        """
+        :return: the path of the blob, the view of the user is linked by `link` once the blob exists
+        """
+        key = str(media_id)
+        folder = os.path.join(self.blob_path, key[-2:])
+        self.check(folder)
+        path = os.path.join(folder, '{0}.{1}'.format(key, self.ext(media_type)))
+        if screen_name is not None:
+            view = self.view(media_id, media_type, screen_name)
+            with self.lock:
+                self.views.setdefault(path, set()).add(view)
+        return path
+
+    def direct(self, file_name: str, media_type: Union[str, MediaType] = None, **kwargs):
+        if media_type:
+            return self.join('{0}.{1}'.format(file_name, self.ext(media_type)))
+        else:
+            return self.join(file_name)
+
+    def view(self, media_id, media_type: Union[str, MediaType], screen_name: str):
+        """
+        :return: the path of the view of the medium for the user
+        """
+        key = screen_name.lower() if self._is_windows() else screen_name
+        folder = self.join(key)
+        self.check(folder)
+        return os.path.join(folder, '{0}.{1}'.format(media_id, self.ext(media_type)))
+
+    def link(self, path: str):
+        """
+        Materialize the views waiting for the blob.
+        :param path: str, the path of the blob
+        :return: int, count of views created
+        """
+        with self.lock:
+            views = self.views.pop(path, set())
+        count = 0
+        for view in views:
+            if os.path.lexists(view):
+                continue
+            try:
+                if self.symlink:
+                    os.symlink(os.path.relpath(path, os.path.dirname(view)), view)
+                else:
+                    try:
+                        os.link(path, view)
+                    except FileExistsError:
+                        raise
+                    except OSError:
+                        os.symlink(os.path.relpath(path, os.path.dirname(view)), view)
+            except FileExistsError:
+                # Linked by another thread
+                continue
+            count += 1
+        return count
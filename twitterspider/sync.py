@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import threading
+from time import time
+
+
+class SyncState:
+    """
+    Persistent per-user high-water marks, backed by SQLite.
+    Keep the newest tweet id crawled of every user, so the next crawl only fetches newer tweets.
+
+    A crawl tells the tweets it yields by `expect` and the end of a user by `finish`,
+    the consumer tells the tweets it has handled by `mark`, e.g. `Pipeline` once they are finished.
+    The mark of a user is saved only when both are done, so the tweets crawled but not handled
+    before a crash are crawled again:
+
+        state = SyncState('./sync.db')
+        for tweet in spider.crawl_following(screen_name='twitter', state=state):
+            ...
+            state.mark(tweet.id)
+    """
+
+    def __init__(self, path: str = './sync.db'):
+        self.path = os.path.abspath(path)
+        self.lock = threading.Lock()
+        # May be used from the crawling thread of a pipeline, guarded by the lock
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS users ('
+                              'user_id INTEGER PRIMARY KEY, since_id INTEGER, updated REAL)')
+        # Tweet id to the user of the tweets yielded but not handled yet, and the count of them of every user
+        self.owners = {}
+        self.pending = {}
+        # The marks of the users crawled, waiting for their tweets to be handled
+        self.finished = {}
+
+    def get(self, user_id):
+        """
+        :return: the newest tweet id crawled of the user, or None if never crawled
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT since_id FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set(self, user_id, since_id):
+        """
+        Save the newest tweet id crawled of the user, an older id never overwrites a newer one.
+        """
+        with self.lock, self.conn:
+            self.conn.execute('INSERT INTO users VALUES (?, ?, ?) ON CONFLICT(user_id) DO UPDATE SET '
+                              'since_id = MAX(since_id, excluded.since_id), updated = excluded.updated',
+                              (user_id, since_id, time()))
+
+    def expect(self, user_id, tweet_id):
+        """
+        Tell a tweet of the user is yielded, the mark of the user waits for it to be handled.
+        """
+        with self.lock:
+            if tweet_id not in self.owners:
+                self.owners[tweet_id] = user_id
+                self.pending[user_id] = self.pending.get(user_id, 0) + 1
+
+    def finish(self, user_id, since_id):
+        """
+        Tell all the tweets of the user are yielded, the mark is saved once they are all handled.
+        """
+        with self.lock:
+            if self.pending.get(user_id, 0) > 0:
+                self.finished[user_id] = max(since_id, self.finished.get(user_id, since_id))
+                return
+        self.set(user_id, since_id)
+
+    def mark(self, tweet_id):
+        """
+        Tell the tweet is handled, tweets never expected are ignored.
+        """
+        with self.lock:
+            user_id = self.owners.pop(tweet_id, None)
+            if user_id is None:
+                return
+            self.pending[user_id] -= 1
+            if self.pending[user_id] > 0:
+                return
+            del self.pending[user_id]
+            since_id = self.finished.pop(user_id, None)
+        if since_id is not None:
+            self.set(user_id, since_id)
+
+    def all(self) -> dict:
+        """
+        :return: dict of user id to the newest tweet id crawled
+        """
+        with self.lock:
+            return dict(self.conn.execute('SELECT user_id, since_id FROM users'))
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
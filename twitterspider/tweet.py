@@ -14,34 +14,114 @@ media_type = {
     'animated_gif': MediaType.video
 }
 
+# Fields of the raw dict used by the spider, the downloader and the checkpoint
+TWEET_FIELDS = ('id', 'id_str', 'text', 'full_text', 'created_at', 'user', 'extended_entities', 'retweeted_status')
+USER_FIELDS = ('id', 'id_str', 'name', 'screen_name')
+
+_UNSET = object()
+
 
 class Tweet:
-    def __init__(self, tweet: dict):
+    """
+    Tweet object, `user`, `media` and `source` are parsed on first access.
+    """
+
+    __slots__ = ('dict', 'id', '_source', '_user', '_media')
+
+    def __init__(self, tweet: dict, fields: tuple = None):
+        """
+        :param tweet: dict, the raw tweet object
+        :param fields: tuple, only keep these fields of the raw dict (see `Tweet.compact`)
+        """
+        if fields is not None:
+            tweet = Tweet.compact(tweet, fields)
         self.dict = tweet
-        self.source = Tweet(tweet['retweeted_status']) if 'retweeted_status' in tweet else self
         self.id = tweet['id']
-        self.user = User(tweet['user'])
-        self.media = list(Media(medium) for medium in tweet['extended_entities']['media']) \
-            if 'extended_entities' in tweet else []
-        self.text = tweet['text']
+        self._source = _UNSET
+        self._user = None
+        self._media = None
+
+    @property
+    def source(self):
+        """
+        The original tweet of a retweet, or the tweet itself.
+        """
+        if self._source is _UNSET:
+            # Never keep a reference to itself, which makes a reference cycle
+            self._source = Tweet(self.dict['retweeted_status']) if 'retweeted_status' in self.dict else None
+        return self if self._source is None else self._source
+
+    @property
+    def user(self):
+        if self._user is None:
+            self._user = User(self.dict['user'])
+        return self._user
+
+    @property
+    def media(self):
+        if self._media is None:
+            self._media = list(Media(medium) for medium in self.dict['extended_entities']['media']) \
+                if 'extended_entities' in self.dict else []
+        return self._media
+
+    @property
+    def text(self):
+        return self.dict['text'] if 'text' in self.dict else self.dict.get('full_text')
+
+    @staticmethod
+    def compact(tweet: dict, fields: tuple = TWEET_FIELDS, user_fields: tuple = USER_FIELDS) -> dict:
+        """
+        Drop the unneeded fields of the raw tweet, including the nested user and retweeted status.
+        :param tweet: dict, the raw tweet object
+        :param fields: tuple, fields of the tweet to keep
+        :param user_fields: tuple, fields of the user to keep
+        :return: dict, the compact tweet object
+        """
+        compact = dict((k, tweet[k]) for k in fields if k in tweet)
+        if 'user' in compact and user_fields is not None:
+            compact['user'] = dict((k, compact['user'][k]) for k in user_fields if k in compact['user'])
+        if 'retweeted_status' in compact:
+            compact['retweeted_status'] = Tweet.compact(compact['retweeted_status'], fields, user_fields)
+        return compact
 
 
 class Media:
+    """
+    Medium object, the url of a video is chosen from its variants on first access.
+    """
+
+    __slots__ = ('type', 'id', '_media', '_url')
+
     def __init__(self, media: dict):
         self.type = media_type[media['type']]
         self.id = media['id']
-        if self.type == MediaType.image:
-            self.url = media['media_url']
-        else:
-            bitrate = 0
-            self.url = ''
-            for variant in media['video_info']['variants']:
-                if 'bitrate' in variant and variant['bitrate'] > bitrate:
-                    self.url = variant['url']
-        self.file_name = os.path.basename(urlparse.urlparse(self.url).path)
+        self._media = media
+        self._url = None
+
+    @property
+    def url(self):
+        if self._url is None:
+            if self.type == MediaType.image:
+                self._url = self._media['media_url']
+            else:
+                # Choose the variant with the highest bitrate
+                bitrate = 0
+                self._url = ''
+                for variant in self._media['video_info']['variants']:
+                    if 'bitrate' in variant and variant['bitrate'] > bitrate:
+                        bitrate = variant['bitrate']
+                        self._url = variant['url']
+        return self._url
+
+    @property
+    def file_name(self):
+        return os.path.basename(urlparse.urlparse(self.url).path)
 
 
 class User:
+
+    __slots__ = ('name', 'nickname', 'id')
+
     def __init__(self, user: dict):
         self.name = user['name']
         self.nickname = user['screen_name']
@@ -1,23 +1,46 @@
 import json
+import logging
 import os
 import sys
-from time import sleep
-from typing import Iterable
-
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from itertools import islice
+from time import perf_counter
+from typing import Iterable, Union
+
+import requests
+from spiderutil.exceptions import RetryLimitExceededException, NetworkException, SpiderException, \
+    UnauthorizedException
 from spiderutil.log import Log
 from spiderutil.network import Session
 from spiderutil.path import StoreByUserName, PathGenerator
 
 from .checkpoint import Checkpoint
+from .decoder import Decoder
+from .manifest import Manifest
+from .metrics import Metrics, REGISTRY
+from .ratelimit import RateLimiter, TokenPool
+from .seen import SeenSet
+from .store import StoreByContent
+from .sync import SyncState
 from .tweet import Tweet
+from . import util
 
 if sys.version_info[0] > 2:
     import urllib.parse as urlparse
 else:
     import urlparse
 
-DELAY = 5
+DELAY = 0
 RETRY = 5
+LOOKUP_SIZE = 100
+FOLLOWING_IDS_SIZE = 5000
+CHUNK_SIZE = 64 * 1024
+# Files larger than the threshold are downloaded in parallel ranges
+SEGMENT_THRESHOLD = 16 * 1024 * 1024
+SEGMENTS = 4
+# Bytes of a range written between two saves of the progress
+SEGMENT_SAVE = 4 * 1024 * 1024
 
 
 class TwitterSpider:
@@ -27,17 +50,32 @@ class TwitterSpider:
     Return list of tweet objects.
     """
 
-    def __init__(self, token: str, proxies: dict = None, delay=DELAY, retry=RETRY,
-                 logger=None, session: Session = None):
+    def __init__(self, token: Union[str, list, TokenPool], proxies: dict = None, delay=DELAY, retry=RETRY,
+                 logger=None, session: Session = None, limiter: RateLimiter = None, fields: tuple = None,
+                 decoder: Decoder = None, metrics: Metrics = None):
+        """
+        :param token: str, the token, or a list of tokens to rotate requests across
+        :param fields: tuple, only keep these fields of the tweets returned by timeline, likes and lookup,
+                       e.g. `TWEET_FIELDS`
+        :param decoder: Decoder, decode the responses, use orjson if it is installed by default
+        :param metrics: Metrics, where to record the requests, default is the shared registry
+        """
         self.base_url = 'https://api.twitter.com/1.1/'
-        self.headers = {'Authorization': token}
         self.logger = logger if logger is not None else Log.create_logger('TwitterSpider', './twitter.log')
         self.delay = delay
+        self.retry = retry
         self.session = Session(retry=retry, proxies=proxies) if session is None else session
+        # The rate limit is governed per token and endpoint, `delay` is only an extra fixed pause between pages
+        self.tokens = token if isinstance(token, TokenPool) else TokenPool(token, limiter)
+        self.limiter = self.tokens.limiter
+        self.fields = fields
+        self.decoder = Decoder() if decoder is None else decoder
+        self.metrics = REGISTRY if metrics is None else metrics
 
     def crawl_timeline(self, screen_name: str = None, user_id: str = None,
                        include_retweets: bool = True, exclude_replies: bool = True,
-                       start_id=None, since_id=None, delay: float = None) -> Iterable[Tweet]:
+                       start_id=None, since_id=None, delay: float = None, prefetch: int = 0,
+                       seen: SeenSet = None) -> Iterable[Tweet]:
         """
         Crawl the timeline of specified user.
         :param screen_name: str, nickname of the user, choose one between screen name and user id
@@ -46,7 +84,11 @@ class TwitterSpider:
         :param exclude_replies: bool, exclude replies or not, default is True
         :param start_id: int, specify the tweet to start from, every tweet has it's own id, the tweet specified is included
         :param since_id: int, specify the oldest tweet, the tweets older than specified one will be filtered out
-        :param delay: int, delay between every network request, to avoid anti-spider mechanism
+        :param delay: int, extra delay between every page, the rate limit of each endpoint is handled by the limiter
+        :param prefetch: int, count of pages requested ahead in the background while the tweets are consumed,
+                         0 to request the next page only after the former one is consumed
+        :param seen: SeenSet, drop the tweets whose id or source id is in the set, tweets are not added by the crawl,
+                     call `seen.mark` once a tweet is handled, or share the set with the `TwitterDownloader`
         :return: iterable list of tweet objects
         """
         if delay is None:
@@ -54,91 +96,290 @@ class TwitterSpider:
 
         self.logger.info('Crawling timeline: %s', locals())
 
-        tweets = self.timeline(screen_name=screen_name, user_id=user_id, include_rts=include_retweets,
-                               exclude_replies=exclude_replies, max_id=start_id, since_id=since_id)
-        if len(tweets) <= 0:
-            return
-        tweet_id = start_id
-        for tweet in tweets:
-            tweet_id = tweet['id']
-            yield Tweet(tweet)
-
-        while len(tweets) > 0:
-            sleep(delay)
-            tweets = self.timeline(screen_name=screen_name, user_id=user_id, include_rts=include_retweets,
-                                   exclude_replies=exclude_replies, max_id=tweet_id - 1, since_id=since_id)
-            for tweet in tweets:
-                tweet_id = tweet['id']
-                yield Tweet(tweet)
+        return self._crawl_pages(lambda max_id: self.timeline(
+            screen_name=screen_name, user_id=user_id, include_rts=include_retweets,
+            exclude_replies=exclude_replies, max_id=max_id, since_id=since_id), start_id, delay, prefetch, seen)
 
     def crawl_likes(self, screen_name: str = None, user_id: str = None,
-                    start_id=None, since_id=None, delay: float = None) -> Iterable[Tweet]:
+                    start_id=None, since_id=None, delay: float = None, prefetch: int = 0,
+                    seen: SeenSet = None, stop_known: bool = True) -> Iterable[Tweet]:
+        """
+        Crawl the tweets liked by specified user, the parameters are the same as `crawl_timeline`.
+        :param stop_known: bool, stop once all the tweets of a page have been seen, likes are ordered by
+                           the time liked rather than the id, so the likes crawled before are not walked again,
+                           the seen set should not be shared with other crawls in this case,
+                           all the likes are walked if the former walk did not reach the end
+        :return: iterable list of tweet objects
+        """
         if delay is None:
             delay = self.delay
 
         self.logger.info('Crawling likes: %s', locals())
 
-        tweets = self.likes(screen_name=screen_name, user_id=user_id, max_id=start_id, since_id=since_id)
-        if len(tweets) <= 0:
-            return
-        tweet_id = start_id
-        for tweet in tweets:
-            tweet_id = tweet['id']
-            yield Tweet(tweet)
-
-        while len(tweets) > 0:
-            sleep(delay)
-            tweets = self.likes(screen_name=screen_name, user_id=user_id, max_id=tweet_id - 1, since_id=since_id)
-            for tweet in tweets:
-                tweet_id = tweet['id']
-                yield Tweet(tweet)
+        walk = 'likes:{}'.format(user_id if user_id is not None else screen_name) if stop_known else None
+        return self._crawl_pages(lambda max_id: self.likes(
+            screen_name=screen_name, user_id=user_id, max_id=max_id, since_id=since_id), start_id, delay, prefetch,
+                                 seen, walk)
+
+    def _crawl_pages(self, fetch, start_id=None, delay: float = 0, prefetch: int = 0,
+                     seen: SeenSet = None, walk: str = None) -> Iterable[Tweet]:
+        """
+        :param walk: str, the key of the walk, stop at a page already seen if the former walk is complete
+        """
+        if seen is None or start_id is not None:
+            walk = None
+        stop_known = walk is not None and seen.begin(walk)
+        last = None
+        pages = self._pages(fetch, start_id, delay)
+        if prefetch is not None and prefetch > 0:
+            # The next page is requested as soon as the id of the last tweet is known
+            pages = util.prefetch(pages, prefetch)
+        # Ids yielded by this crawl, the seen set is only added by the consumer
+        yielded = set()
+        try:
+            for tweets in pages:
+                known = 0
+                for tweet in tweets:
+                    # Duplicates are dropped before they are parsed
+                    if seen is not None:
+                        source = tweet.get('retweeted_status')
+                        ids = (tweet['id'], source['id']) if isinstance(source, dict) else (tweet['id'],)
+                        if seen.known(tweet) or any(i in yielded for i in ids):
+                            known += 1
+                            continue
+                        yielded.update(ids)
+                        last = tweet
+                    yield Tweet(tweet)
+                if stop_known and known >= len(tweets):
+                    self.logger.info('Stop at a page of %d tweets seen.', known)
+                    break
+            if walk is not None:
+                seen.end(walk, last)
+        finally:
+            pages.close()
+
+    @staticmethod
+    def _pages(fetch, max_id=None, delay: float = 0) -> Iterable[list]:
+        while True:
+            tweets = fetch(max_id)
+            if len(tweets) <= 0:
+                return
+            yield tweets
+            # The max id is inclusive, continue from the one older than the last tweet
+            max_id = tweets[-1]['id'] - 1
+            util.wait(delay)
 
     def crawl_following(self, screen_name: str = None, user_id: str = None,
                         include_retweets: bool = True, exclude_replies: bool = True,
-                        checkpoint: Checkpoint = None, delay: float = None) -> Iterable[Tweet]:
+                        checkpoint: Checkpoint = None, delay: float = None, ids: bool = True,
+                        state: SyncState = None, prefetch: int = 0, seen: SeenSet = None) -> Iterable[Tweet]:
+        """
+        Crawl the timelines of all the users followed by specified user.
+        :param screen_name: str, nickname of the user, choose one between screen name and user id
+        :param user_id: str, user id, choose one between screen name and user id
+        :param include_retweets: bool, include retweets or not, default is True
+        :param exclude_replies: bool, exclude replies or not, default is True
+        :param checkpoint: Checkpoint, resume from the user and the tweet in the checkpoint,
+                           the cursor in the checkpoint must come from the same `ids` mode,
+                           if the user is not followed any more, all the users from the cursor are crawled
+        :param delay: int, extra delay between every page
+        :param ids: bool, enumerate the following users by ids (5000 per request) instead of
+                    complete user objects (200 per request), the timeline only needs the user id
+        :param state: SyncState, only crawl the tweets newer than the ones crawled before of every user,
+                      the newest id of a user is saved once all the tweets of the user have been yielded
+                      and marked as handled by the consumer, see `SyncState`
+        :param prefetch: int, count of pages of every timeline requested ahead, see `crawl_timeline`
+        :param seen: SeenSet, drop the tweets whose id or source id has been seen
+        :return: iterable list of tweet objects
+        """
         if delay is None:
             delay = self.delay
-        cursor = checkpoint.cursor
+        cursor = checkpoint.cursor if checkpoint is not None else None
         start = checkpoint is None or checkpoint.start
 
         self.logger.info('Crawling following: %s', locals())
 
-        users = self.following(screen_name=screen_name, user_id=user_id, cursor=cursor)
-
-        for user in users['users']:
+        kwargs = dict(include_retweets=include_retweets, exclude_replies=exclude_replies, delay=delay,
+                      state=state, prefetch=prefetch, seen=seen)
+        # Users before the one of the checkpoint, crawled if it is not followed any more
+        skipped = []
+        for following_id in self._crawl_following(screen_name=screen_name, user_id=user_id,
+                                                  cursor=cursor, ids=ids, delay=delay):
+            start_id = None
             if not start:
-                if checkpoint.user_id is None or user['id'] == checkpoint.user_id:
-                    start = True
-                    sleep(delay)
-                    for tweet in self.crawl_timeline(user_id=user['id'], include_retweets=include_retweets,
-                                                     exclude_replies=exclude_replies, start_id=checkpoint.tweet_id,
-                                                     delay=delay):
-                        yield tweet
-                else:
+                if following_id != checkpoint.user_id:
+                    skipped.append(following_id)
                     continue
-            else:
-                sleep(delay)
-                for tweet in self.crawl_timeline(user_id=user['id'], include_retweets=include_retweets,
-                                                 exclude_replies=exclude_replies, delay=delay):
-                    yield tweet
-        cursor = users['next_cursor']
-
-        while len(users['users']) > 0:
-            sleep(delay)
-            users = self.following(screen_name=screen_name, user_id=user_id, cursor=cursor)
-            for user in users['users']:
-                sleep(delay)
-                for tweet in self.crawl_timeline(user_id=user['id'], include_retweets=include_retweets,
-                                                 exclude_replies=exclude_replies, delay=delay):
+                start = True
+                start_id = checkpoint.tweet_id
+            for tweet in self._crawl_followed(following_id, start_id=start_id, **kwargs):
+                yield tweet
+        if not start:
+            self.logger.warning('User %s of the checkpoint is not followed any more, '
+                                'crawl from the cursor of the checkpoint.', checkpoint.user_id)
+            for following_id in skipped:
+                for tweet in self._crawl_followed(following_id, **kwargs):
                     yield tweet
+
+    def _crawl_followed(self, following_id, start_id=None, include_retweets: bool = True,
+                        exclude_replies: bool = True, delay: float = 0, state: SyncState = None,
+                        prefetch: int = 0, seen: SeenSet = None) -> Iterable[Tweet]:
+        since_id = state.get(following_id) if state is not None else None
+        # Tweets newer than the start of a resumed timeline have been crawled already
+        newest = start_id
+        util.wait(delay)
+        for tweet in self.crawl_timeline(user_id=following_id, include_retweets=include_retweets,
+                                         exclude_replies=exclude_replies, start_id=start_id,
+                                         since_id=since_id, delay=delay, prefetch=prefetch, seen=seen):
+            if newest is None or tweet.id > newest:
+                newest = tweet.id
+            if state is not None:
+                state.expect(following_id, tweet.id)
+            yield tweet
+        if state is not None and newest is not None:
+            state.finish(following_id, newest)
+
+    def crawl_following_ids(self, screen_name: str = None, user_id: str = None,
+                            delay: float = None) -> Iterable[int]:
+        """
+        Crawl the ids of all the users followed by specified user, 5000 ids per request.
+        :return: iterable list of user ids
+        """
+        if delay is None:
+            delay = self.delay
+
+        self.logger.info('Crawling following IDs: %s', locals())
+
+        return self._crawl_following(screen_name=screen_name, user_id=user_id, ids=True, delay=delay)
+
+    def crawl_following_users(self, screen_name: str = None, user_id: str = None,
+                              delay: float = None) -> Iterable[dict]:
+        """
+        Crawl all the users followed by specified user.
+        The ids are enumerated first and then hydrated with users/lookup, 100 users per request.
+        :return: iterable list of user objects
+        """
+        if delay is None:
+            delay = self.delay
+
+        self.logger.info('Crawling following users: %s', locals())
+
+        return self.lookup_users(self._crawl_following(screen_name=screen_name, user_id=user_id,
+                                                       ids=True, delay=delay))
+
+    def _crawl_following(self, screen_name: str = None, user_id: str = None, cursor=None,
+                         ids: bool = True, delay: float = None) -> Iterable[int]:
+        cursor = -1 if cursor is None else cursor
+        while True:
+            if ids:
+                users = self.following_ids(screen_name=screen_name, user_id=user_id, cursor=cursor,
+                                           count=FOLLOWING_IDS_SIZE)
+                following = users['ids']
+            else:
+                users = self.following(screen_name=screen_name, user_id=user_id, cursor=cursor)
+                following = [user['id'] for user in users['users']]
+            for following_id in following:
+                yield following_id
             cursor = users['next_cursor']
+            # The cursor is 0 at the last page
+            if len(following) <= 0 or cursor == 0:
+                return
+            util.wait(delay)
+
+    def lookup_users(self, user_ids: Iterable, include_entitles: bool = None) -> Iterable[dict]:
+        """
+        Fetch users in bulk, up to 100 users per request.
+        Suspended or deleted users are skipped.
+        :param user_ids: iterable list of user ids
+        :param include_entitles: bool, the entities node will not be included when set to false
+        :return: iterable list of user objects
+        """
+        user_ids = iter(user_ids)
+        while True:
+            batch = list(islice(user_ids, LOOKUP_SIZE))
+            if len(batch) <= 0:
+                return
+            for user in self.users(user_ids=batch, include_entitles=include_entitles):
+                yield user
+
+    def lookup_tweets(self, tweet_ids: Iterable, trim_user: bool = None,
+                      include_entitles: bool = None) -> Iterable[Tweet]:
+        """
+        Fetch tweets in bulk, up to 100 tweets per request.
+        Deleted or protected tweets are skipped.
+        :param tweet_ids: iterable list of tweet ids
+        :param trim_user: bool, only include the user id instead of the complete user object
+        :param include_entitles: bool, the entities node will not be included when set to false
+        :return: iterable list of tweet objects
+        """
+        tweet_ids = iter(tweet_ids)
+        while True:
+            batch = list(islice(tweet_ids, LOOKUP_SIZE))
+            if len(batch) <= 0:
+                return
+            for tweet in self.lookup(batch, trim_user=trim_user, include_entitles=include_entitles):
+                yield Tweet(tweet)
 
-    def _get(self, url, params):
+    def _get(self, url, params, fields: tuple = None):
         """
         Access API with requests and return the result with the format of json.
+        The request is governed by the rate limit of its endpoint.
+        :param fields: tuple, project every tweet in the result to these fields
         """
-        r = self.session.get(url=url, params=params, headers=self.headers)
-        return json.loads(r.text)
+        endpoint = urlparse.urlparse(url).path
+        retry = self.retry if self.retry else 1
+        # Being rate limited is not a failure, but every token could only be rate limited a few times
+        limited = len(self.tokens) * retry
+        while True:
+            token, delay = self.tokens.acquire(endpoint)
+            if delay > 0:
+                if delay > 1:
+                    self.logger.info('Waiting %.1fs for the rate limit of %s', delay, endpoint)
+                self.metrics.inc('twitter_api_wait_seconds_total', delay, endpoint=endpoint)
+                util.wait(delay)
+            # Request with the pooled session directly, the rate-limit headers of a 429 are needed
+            start = perf_counter()
+            try:
+                r = self.session.session.get(url=url, params=params, headers={'Authorization': token},
+                                             proxies=self.session.proxies, timeout=self.session.timeout)
+            except requests.exceptions.RequestException as e:
+                self._measure(endpoint, 'error', perf_counter() - start, params=params)
+                retry -= 1
+                if retry <= 0:
+                    raise RetryLimitExceededException(url) from e
+                continue
+            self._measure(endpoint, r.status_code, perf_counter() - start, len(r.content), params)
+            self.tokens.update(token, endpoint, r.headers)
+            remaining = self.tokens.remaining(endpoint)
+            if remaining is not None:
+                self.metrics.set('twitter_api_rate_limit_remaining', remaining, endpoint=endpoint)
+            if r.status_code == 200:
+                return self.decoder.decode(r.content, fields)
+            if r.status_code == 429:
+                limited -= 1
+                if limited <= 0:
+                    raise RetryLimitExceededException(url)
+                # Wait for the reset, or fail over to another token
+                self.logger.warning('Rate limit exceeded: %s', endpoint)
+                self.tokens.exhaust(token, endpoint)
+                continue
+            if r.status_code == 401:
+                raise UnauthorizedException(url)
+            retry -= 1
+            if retry <= 0:
+                raise RetryLimitExceededException(url) from NetworkException(
+                    'Error Code: {} - {}'.format(r.status_code, url))
+
+    def _measure(self, endpoint, status, seconds, size=None, params=None):
+        self.metrics.inc('twitter_api_requests_total', endpoint=endpoint, status=status)
+        self.metrics.observe('twitter_api_request_seconds', seconds, endpoint=endpoint)
+        self.metrics.request('api', endpoint, status, seconds, size)
+        # Formatted later by the handler, and could be sampled by the event, see `logger.create_logger`,
+        # failed requests are warnings and always kept
+        self.logger.log(logging.INFO if status == 200 else logging.WARNING, 'Request %s %s %.3fs',
+                        endpoint, status, seconds,
+                        extra={'event': 'api.request', 'endpoint': endpoint, 'status': status,
+                               'duration': seconds, 'bytes': size, 'params': params})
 
     def _url(self, url):
         return urlparse.urljoin(self.base_url, url)
@@ -197,10 +438,9 @@ class TwitterSpider:
         """
         params = locals()
         del (params['self'])
-        self.logger.info('Get timeline: %s', params)
         if user_id is None and screen_name is None:
             raise ValueError('User ID or username is required.')
-        return self._get(self._url('statuses/user_timeline.json'), params)
+        return self._get(self._url('statuses/user_timeline.json'), params, fields=self.fields)
 
     def user(self, user_id: str = None, screen_name: str = None, include_entitles: bool = None):
         """
@@ -229,11 +469,43 @@ class TwitterSpider:
         """
         params = locals()
         del (params['self'])
-        self.logger.info('Get user: %s', params)
         if user_id is None and screen_name is None:
             raise ValueError('User ID or username is required')
         return self._get(self._url('user/show.json'), params)
 
+    def users(self, user_ids: list = None, screen_names: list = None, include_entitles: bool = None):
+        """
+        Returns fully-hydrated user objects for up to 100 users per request,
+        as specified by comma-separated values passed to the user_id and/or screen_name parameters.
+
+        This method is especially useful when used in conjunction with collections of user IDs
+        returned from GET friends / ids and GET followers / ids.
+
+        Response formats: JSON
+        Requires authentication? Yes
+        Rate limited? Yes
+        Requests / 15-min window (user auth): 900
+        Requests / 15-min window (app auth): 300
+
+        Check https://developer.twitter.com/en/docs/accounts-and-users/follow-search-get-users/api-reference/get-users-lookup
+        for more information.
+
+        :param user_ids: A list of user IDs, up to 100 are allowed in a single request.
+        :param screen_names: A list of screen names, up to 100 are allowed in a single request.
+        :param include_entitles: The entities node that may appear within embedded statuses
+                                 will not be included when set to false.
+        :return: List of user objects, suspended or deleted users are not included.
+        """
+        params = locals()
+        del (params['self'])
+        if not user_ids and not screen_names:
+            raise ValueError('User ID or username is required')
+        if len(user_ids or []) + len(screen_names or []) > LOOKUP_SIZE:
+            raise ValueError('Up to {} users are allowed in a single request'.format(LOOKUP_SIZE))
+        params['user_id'] = ','.join(str(user_id) for user_id in params.pop('user_ids') or []) or None
+        params['screen_name'] = ','.join(params.pop('screen_names') or []) or None
+        return self._get(self._url('users/lookup.json'), params)
+
     def followers(self, user_id: str = None, screen_name: str = None, cursor=None,
                   count: int = 200, skip_status: bool = None, include_user_entitles: bool = None):
         """
@@ -277,7 +549,6 @@ class TwitterSpider:
         """
         params = locals()
         del (params['self'])
-        self.logger.info('Get followers: %s', params)
         if user_id is None and screen_name is None:
             raise ValueError('User ID or username is required')
         return self._get(self._url('followers/list.json'), params)
@@ -323,7 +594,6 @@ class TwitterSpider:
         """
         params = locals()
         del (params['self'])
-        self.logger.info('Get follower IDs: %s', params)
         if user_id is None and screen_name is None:
             raise ValueError('User ID or username is required')
         return self._get(self._url('followers/ids.json'), params)
@@ -373,7 +643,6 @@ class TwitterSpider:
         """
         params = locals()
         del (params['self'])
-        self.logger.info('Get followings: %s', params)
         if user_id is None and screen_name is None:
             raise ValueError('User ID or username is required')
         return self._get(self._url('friends/list.json'), params)
@@ -409,7 +678,7 @@ class TwitterSpider:
                         from the API will include a previous_cursor and next_cursor to allow
                         paging back and forth. See Using cursors to navigate collections for
                         more information.
-        :param count: The number of users to return per page, up to a maximum of 200. Defaults to 20.
+        :param count: The number of IDs to return per page, up to a maximum of 5000.
         :param stringify_ids:
         :return: {
                     "ids": [],
@@ -421,7 +690,6 @@ class TwitterSpider:
         """
         params = locals()
         del (params['self'])
-        self.logger.info('Get following IDs: %s', params)
         if user_id is None and screen_name is None:
             raise ValueError('User ID or username is required')
         return self._get(self._url('friends/ids.json'), params)
@@ -457,10 +725,9 @@ class TwitterSpider:
         """
         params = locals()
         del (params['self'])
-        self.logger.info('Get likes: %s', params)
         if user_id is None and screen_name is None:
             raise ValueError('User ID or username is required')
-        return self._get(self._url('favorites/list.json'), params)
+        return self._get(self._url('favorites/list.json'), params, fields=self.fields)
 
     def tweet(self, tweet_id: str, trim_user: bool = None,
               include_my_retweet: bool = None, include_entitles: bool = None,
@@ -509,16 +776,68 @@ class TwitterSpider:
         """
         params = locals()
         del (params['self'])
-        self.logger.info('Get tweet: %s', params)
         if tweet_id is None:
             raise ValueError('Tweet ID is required')
         return self._get(self._url('statuses/show.json'), params)
 
+    def lookup(self, tweet_ids: list, trim_user: bool = None, include_entitles: bool = None,
+               include_ext_alt_text: bool = None, include_card_uri: bool = None):
+        """
+        Returns fully-hydrated Tweet objects for up to 100 Tweets per request,
+        as specified by comma-separated values passed to the id parameter.
+
+        This method is especially useful to get the details (hydrate) a collection of Tweet IDs.
+
+        GET statuses / show / :id is used to retrieve a single Tweet object.
+
+        Response formats: JSON
+        Requires authentication? Yes
+        Rate limited? Yes
+        Requests / 15-min window (user auth): 900
+        Requests / 15-min window (app auth): 300
+
+        Check https://developer.twitter.com/en/docs/tweets/post-and-engage/api-reference/get-statuses-lookup
+        for more information.
+
+        :param tweet_ids: A list of Tweet IDs, up to 100 are allowed in a single request.
+        :param trim_user: When set to either true , t or 1 , each Tweet returned in a timeline will
+                          include a user object including only the status authors numerical ID.
+                          Omit this parameter to receive the complete user object.
+        :param include_entitles: The entities node that may appear within embedded statuses
+                                 will not be included when set to false.
+        :param include_ext_alt_text: If alt text has been added to any attached media entities, this
+                                     parameter will return an ext_alt_text value in the top-level key
+                                     for the media entity. If no value has been set, this will be
+                                     returned as null.
+        :param include_card_uri: When set to either true , t or 1 , each Tweet returned will include
+                                 a card_uri attribute when there is an ads card attached to the Tweet
+                                 and when that card was attached using the card_uri value.
+        :return: List of tweet objects, deleted or protected tweets are not included.
+        """
+        params = locals()
+        del (params['self'])
+        if tweet_ids is None or len(tweet_ids) <= 0:
+            raise ValueError('Tweet ID is required')
+        if len(tweet_ids) > LOOKUP_SIZE:
+            raise ValueError('Up to {} tweets are allowed in a single request'.format(LOOKUP_SIZE))
+        params['id'] = ','.join(str(tweet_id) for tweet_id in params.pop('tweet_ids'))
+        return self._get(self._url('statuses/lookup.json'), params, fields=self.fields)
+
 
 class TwitterDownloader:
 
     def __init__(self, path: PathGenerator = None, proxies: dict = None, retry=RETRY,
-                 logger=None, session: Session = None):
+                 logger=None, session: Session = None, chunk_size: int = CHUNK_SIZE,
+                 manifest: Manifest = None, metrics: Metrics = None, seen: SeenSet = None,
+                 segment_threshold: int = SEGMENT_THRESHOLD, segments: int = SEGMENTS):
+        """
+        :param manifest: Manifest or str, media recorded in the manifest are skipped
+        :param seen: SeenSet, tweets downloaded are added and skipped later,
+                     share it with the crawl to drop the tweets downloaded before they are parsed
+        :param segment_threshold: int, files of this size in bytes or larger, e.g. long videos, are split into
+                                  ranges fetched in parallel, None to always download in a single stream
+        :param segments: int, count of ranges of a large file
+        """
         if path is None:
             self.path = StoreByUserName('./download')
         elif type(path) is str:
@@ -526,25 +845,407 @@ class TwitterDownloader:
         else:
             self.path = path
         self.logger = Log.create_logger('TwitterSpider', './twitter.log') if logger is None else logger
+        self.retry = retry
+        self.chunk_size = chunk_size
         self.session = Session(proxies=proxies, retry=retry) if session is None else session
+        # Media recorded in the manifest are skipped without any network request
+        self.manifest = Manifest(manifest) if type(manifest) is str else manifest
+        self.metrics = REGISTRY if metrics is None else metrics
+        self.seen = seen
+        self.segment_threshold = segment_threshold
+        self.segments = segments
+        self.claims = _Claims()
+
+    def _get(self, url, offset: int = 0, end: int = None) -> requests.Response:
+        """
+        Open a streaming response of the url, start from the offset with a Range request.
+        :param end: int, the last byte of the range, None for the end of the file
+        """
+        headers = {'Accept-Encoding': 'identity'}
+        if offset > 0 or end is not None:
+            headers['Range'] = 'bytes={}-{}'.format(offset, '' if end is None else end)
+        host = urlparse.urlparse(url).netloc
+        start = perf_counter()
+        try:
+            r = self.session.session.get(url=url, headers=headers, stream=True,
+                                         proxies=self.session.proxies, timeout=self.session.timeout)
+        except requests.exceptions.RequestException:
+            self.metrics.inc('twitter_download_requests_total', host=host, status='error')
+            raise
+        self.metrics.inc('twitter_download_requests_total', host=host, status=r.status_code)
+        self.metrics.observe('twitter_download_response_seconds', perf_counter() - start, host=host)
+        return r
+
+    def _save(self, r: requests.Response, path, offset: int = 0):
+        """
+        Write the streaming response into the (partial) file in chunks.
+        :return: the expected size of the whole file, or None if unknown
+        """
+        url = r.url
+        if r.status_code == 206:
+            if not r.headers.get('Content-Range', '').startswith('bytes {}-'.format(offset)):
+                # Not the rest of the partial file, restart from the beginning
+                if os.path.isfile(path):
+                    os.remove(path)
+                raise NetworkException('Unexpected range {} - {}'.format(r.headers.get('Content-Range'), url))
+            mode = 'ab'
+            total = _content_range_total(r)
+        elif r.status_code == 200:
+            # The server ignores the range, restart from the beginning
+            mode, offset = 'wb', 0
+            total = int(r.headers['Content-Length']) if 'Content-Length' in r.headers else None
+        elif r.status_code == 416 and _content_range_total(r) == offset:
+            # The partial file is already complete
+            return offset
+        else:
+            if r.status_code == 416:
+                os.remove(path)
+            raise NetworkException('Error Code: {} - {}'.format(r.status_code, url))
+        size = 0
+        try:
+            with open(path, mode) as f:
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    size += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            self.metrics.inc('twitter_download_bytes_total', size, host=urlparse.urlparse(url).netloc)
+        return total
+
+    def _split(self, r: requests.Response):
+        """
+        :return: the size of the file if it should be downloaded in segments, otherwise None
+        """
+        if self.segment_threshold is None or self.segments <= 1 or r.status_code != 200 \
+                or 'bytes' not in r.headers.get('Accept-Ranges', '') or 'Content-Length' not in r.headers:
+            return None
+        total = int(r.headers['Content-Length'])
+        return total if total >= self.segment_threshold else None
 
-    def _get(self, url):
-        r = self.session.get(url=url)
-        return r.content
-
-    def _save(self, content, path):
-        if os.path.exists(path):
-            self.logger.warning('File %s exists.', path)
-            return False
-        with open(path, 'wb') as f:
-            f.write(content)
+    def _save_segments(self, r: requests.Response, path, total: int):
+        """
+        Preallocate the file and fetch its ranges in parallel, every range is written at its offset.
+        The first range is read from the response of the whole file, which is then dropped.
+        The progress of the ranges is recorded beside the file with the validator of the file,
+        a download interrupted by a failure or a crash is resumed from there if the file is not changed.
+        """
+        url = r.url
+        validator = _validator(r)
+        segments = _Segments.load(path, total, validator)
+        if segments is None:
+            with open(path, 'wb') as f:
+                f.truncate(total)
+            length = -(-total // self.segments)
+            segments = _Segments(path, total, [[start, min(start + length, total) - 1]
+                                               for start in range(0, total, length)], validator)
+            segments.save()
+        indexes = [i for i, (position, end) in enumerate(segments.ranges) if position <= end]
+        self.logger.debug('Download %s in %d segments', url, len(indexes))
+        cancel = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=max(len(indexes), 1))
+        try:
+            futures = [executor.submit(self._segment, url, path, segments, i, cancel,
+                                       r if segments.ranges[i][0] == 0 else None) for i in indexes]
+            wait(futures, return_when=FIRST_EXCEPTION)
+            # Stop the other ranges once one has failed
+            cancel.set()
+            for future in futures:
+                future.result()
+        except _RangeIgnored:
+            cancel.set()
+            executor.shutdown(wait=True)
+            segments.remove()
+            os.remove(path)
+            raise
+        except BaseException:
+            cancel.set()
+            executor.shutdown(wait=True)
+            raise
+        executor.shutdown(wait=True)
+        with open(path, 'rb+') as f:
+            os.fsync(f.fileno())
+        # A complete file without the record is downloaded again, never renamed half written
+        segments.remove()
+        return total
+
+    def _segment(self, url, path, segments, index: int, cancel: threading.Event, r: requests.Response = None):
+        """
+        Write the rest of a range into the file, a broken range is resumed where it stops.
+        The data is synced before its position is recorded, every few megabytes and when the range stops.
+        """
+        position, end = segments.ranges[index]
+        retry = self.retry if self.retry else 1
+        saved = position
+        with open(path, 'rb+') as f:
+            try:
+                while position <= end and not cancel.is_set():
+                    try:
+                        if r is None:
+                            r = self._get(url, position, end)
+                            if r.status_code == 200:
+                                raise _RangeIgnored(url)
+                            if r.status_code != 206 or \
+                                    not r.headers.get('Content-Range', '').startswith('bytes {}-'.format(position)):
+                                raise NetworkException('Error Code: {} - {}'.format(r.status_code, url))
+                        f.seek(position)
+                        size = 0
+                        try:
+                            for chunk in r.iter_content(chunk_size=self.chunk_size):
+                                if cancel.is_set():
+                                    return
+                                chunk = chunk[:end + 1 - position]
+                                f.write(chunk)
+                                position += len(chunk)
+                                size += len(chunk)
+                                if position - saved >= SEGMENT_SAVE:
+                                    saved = position
+                                    _sync(f)
+                                    segments.save(index, position)
+                                if position > end:
+                                    break
+                        finally:
+                            self.metrics.inc('twitter_download_bytes_total', size,
+                                             host=urlparse.urlparse(url).netloc)
+                        if position <= end:
+                            raise NetworkException('Incomplete segment {}-{} - {}'.format(position, end, url))
+                    except (requests.exceptions.RequestException, SpiderException):
+                        retry -= 1
+                        if retry <= 0:
+                            raise
+                    finally:
+                        if r is not None:
+                            r.close()
+                            r = None
+            finally:
+                if position > saved:
+                    _sync(f)
+                    segments.save(index, position)
+
+    @staticmethod
+    def _partial(url, path):
+        # Named by the medium rather than the generated path, which may change between runs
+        file_name = os.path.basename(urlparse.urlparse(url).path)
+        return os.path.join(os.path.dirname(path), '.{}.part'.format(file_name))
+
+    def fetch(self, url, path, media_id=None):
+        """
+        Download the url into the path.
+        The file is streamed into a partial file and then renamed into the path,
+        an interrupted download is resumed from the partial file.
+        A file larger than the segment threshold is fetched in parallel ranges into a separate temporary file,
+        whose finished ranges are recorded and resumed the same way, or in a single stream
+        if the server ignores the ranges.
+        Concurrent fetches of the same medium into the same folder, e.g. retweets of the same tweet,
+        are serialized, the later ones find the file written.
+        :param media_id: int, id of the medium, recorded in the manifest
+        :return: bool, False if the path already exists
+        """
+        partial = self._partial(url, path)
+        self.claims.acquire(partial)
+        try:
+            if os.path.exists(path):
+                self.logger.warning('File %s exists.', path)
+                if isinstance(self.path, StoreByContent):
+                    # Written by another thread, views generated since then are still waiting
+                    self.path.link(path)
+                return False
+            return self._fetch(url, path, partial, media_id)
+        finally:
+            self.claims.release(partial)
+
+    def _fetch(self, url, path, partial, media_id=None):
+        # Never resumed as a partial file, the unwritten ranges of a preallocated file are zeros,
+        # it is resumed with the record of its ranges
+        segmented = partial[:-len('.part')] + '.seg'
+        split = True
+        retry = self.retry if self.retry else 1
+        start = perf_counter()
+        while True:
+            try:
+                offset = os.path.getsize(partial) if os.path.isfile(partial) else 0
+                with self._get(url, offset) as r:
+                    total = self._split(r) if split and offset == 0 else None
+                    if total is not None:
+                        temp = segmented
+                        self._save_segments(r, temp, total)
+                    else:
+                        temp = partial
+                        total = self._save(r, temp, offset)
+                size = os.path.getsize(temp)
+                if total is not None and size != total:
+                    if size > total:
+                        os.remove(temp)
+                    raise NetworkException('Incomplete file {}/{} - {}'.format(size, total, url))
+                break
+            except _RangeIgnored:
+                self.logger.info('Range ignored by %s, download in a single stream.', url)
+                split = False
+            except (requests.exceptions.RequestException, SpiderException) as e:
+                retry -= 1
+                if retry <= 0:
+                    self.metrics.inc('twitter_download_failures_total')
+                    self.metrics.request('download', url, 'error', perf_counter() - start)
+                    raise RetryLimitExceededException(url) from e
+        os.replace(temp, path)
+        seconds = perf_counter() - start
+        self.metrics.inc('twitter_files_written_total')
+        self.metrics.observe('twitter_download_seconds', seconds)
+        self.metrics.request('download', url, 200, seconds, size)
+        self.logger.debug('Downloaded %s %d bytes %.3fs', url, size, seconds,
+                          extra={'event': 'download', 'url': url, 'path': path, 'bytes': size, 'duration': seconds})
+        if isinstance(self.path, StoreByContent):
+            self.path.link(path)
+        if self.manifest is not None:
+            self.manifest.add(path, media_id=media_id, url=url)
         return True
 
-    def download(self, tweet: Tweet):
+    def tasks(self, tweet: Tweet):
+        """
+        Generate the path of every medium in the tweet, media in the manifest or the store are skipped.
+        Paths are generated in order, so it should be called from one thread only.
+        :return: iterable list of (medium, path)
+        """
+        if self.seen is not None and tweet.id in self.seen:
+            return
         user = tweet.user
+        store = isinstance(self.path, StoreByContent)
         for medium in tweet.media:
+            if not store and self.manifest is not None \
+                    and self.manifest.find(media_id=medium.id, url=medium.url) is not None:
+                self.logger.info('Medium %s exists.', medium.id)
+                continue
             # def path(self, file_name, media_type, media_id, media_url, user_id, user_name, screen_name)
             path = self.path.generate(file_name=medium.file_name, media_type=medium.type, media_id=medium.id,
                                       media_url=medium.url, user_id=user.id, user_name=user.name,
                                       screen_name=user.nickname)
-            self._save(self._get(medium.url), path)
+            if store and os.path.isfile(path):
+                # The blob is stored already, only the view of this user is needed
+                self.path.link(path)
+                continue
+            yield medium, path
+
+    def download(self, tweet: Tweet):
+        for medium, path in self.tasks(tweet):
+            self.fetch(medium.url, path, media_id=medium.id)
+        self.mark(tweet)
+
+    def mark(self, tweet: Tweet):
+        """
+        Record the tweet as downloaded in the seen set.
+        """
+        if self.seen is not None:
+            self.seen.mark(tweet.dict)
+
+
+class _Claims:
+    """
+    Locks of the partial files being written, a lock is dropped once no thread holds or waits for it.
+    """
+
+    def __init__(self):
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key):
+        with self.lock:
+            lock, count = self.locks.get(key, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self.locks[key] = lock, count + 1
+        lock.acquire()
+
+    def release(self, key):
+        with self.lock:
+            lock, count = self.locks[key]
+            if count <= 1:
+                del self.locks[key]
+            else:
+                self.locks[key] = lock, count - 1
+        lock.release()
+
+
+class _Segments:
+    """
+    Progress of the ranges of a segmented download, `[position, end]` of every range,
+    saved atomically into `<path>.ranges`.
+    """
+
+    def __init__(self, path, total: int, ranges: list, validator: str = None):
+        """
+        :param validator: str, the ETag or Last-Modified of the file, see `_validator`
+        """
+        self.path = path
+        self.total = total
+        self.ranges = ranges
+        self.validator = validator
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def record_path(path):
+        return path + '.ranges'
+
+    @staticmethod
+    def load(path, total: int, validator: str = None):
+        """
+        :return: the progress of the file, or None if it is missing or belongs to another version of the file
+        """
+        record = _Segments.record_path(path)
+        if not os.path.isfile(path) or not os.path.isfile(record) or os.path.getsize(path) != total:
+            return None
+        try:
+            with open(record, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except ValueError:
+            return None
+        if data.get('total') != total or data.get('validator') != validator:
+            return None
+        return _Segments(path, total, data['ranges'], validator)
+
+    def save(self, index: int = None, position: int = None):
+        """
+        Record the position of a range, and save the progress of all the ranges.
+        """
+        with self.lock:
+            if index is not None:
+                self.ranges[index][0] = position
+            record = self.record_path(self.path)
+            temp = record + '.tmp'
+            with open(temp, 'w', encoding='utf-8') as f:
+                json.dump({'total': self.total, 'validator': self.validator, 'ranges': self.ranges}, f)
+            os.replace(temp, record)
+
+    def remove(self):
+        with self.lock:
+            if os.path.isfile(self.record_path(self.path)):
+                os.remove(self.record_path(self.path))
+
+
+def _sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _validator(r: requests.Response):
+    """
+    :return: the strong ETag of the response, or Last-Modified if there is none, None if neither
+    """
+    etag = r.headers.get('ETag')
+    if etag is not None and not etag.startswith('W/'):
+        return 'etag:' + etag
+    if 'Last-Modified' in r.headers:
+        return 'last-modified:' + r.headers['Last-Modified']
+    return None
+
+
+class _RangeIgnored(Exception):
+    """
+    The server responds with the whole file to a Range request.
+    """
+
+
+def _content_range_total(r: requests.Response):
+    # Content-Range: bytes 0-99/1000 or bytes */1000
+    content_range = r.headers.get('Content-Range', '')
+    total = content_range.rpartition('/')[2]
+    return int(total) if total.isdigit() else None
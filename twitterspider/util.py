@@ -1,6 +1,100 @@
+import threading
+from queue import Queue, Full
+from time import sleep
+from typing import Iterable
+
+_END = object()
+
+_local = threading.local()
+
+
+class Interrupted(Exception):
+    """
+    Raised by `wait` once the stop event of the thread is set.
+    """
+
+
+def interruptible(stop: threading.Event):
+    """
+    Bind the stop event to the current thread, `wait` in this thread returns once it is set,
+    e.g. a crawl waiting for the rate limit is stopped when the consumer is gone.
+    """
+    _local.stop = stop
+
+
+def wait(seconds: float):
+    """
+    Sleep, or raise `Interrupted` once the stop event bound to the thread is set.
+    """
+    stop = getattr(_local, 'stop', None)
+    if stop is None:
+        sleep(seconds)
+    elif stop.wait(seconds):
+        raise Interrupted()
+
+
+def put(queue: Queue, item, stop: threading.Event) -> bool:
+    """
+    Block while the queue is full, until the consumer is gone.
+    :return: bool, False if the stop event is set before the item is put
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=1)
+            return True
+        except Full:
+            continue
+    return False
+
+
 class TokenReader:
 
     @staticmethod
     def from_local_file(path, encoding='utf-8'):
         with open(path, 'r', encoding=encoding) as f:
             return f.readline().strip()
+
+    @staticmethod
+    def pool_from_local_file(path, encoding='utf-8'):
+        """
+        Read all the tokens in the file, one token per line.
+        """
+        with open(path, 'r', encoding=encoding) as f:
+            return [line.strip() for line in f if len(line.strip()) > 0]
+
+
+def prefetch(items: Iterable, depth: int) -> Iterable:
+    """
+    Iterate the items in a background thread, up to `depth` items ahead of the consumer.
+    Exceptions are raised to the consumer, the thread stops once the consumer closes the generator.
+    :param items: iterable list of anything
+    :param depth: int, count of items fetched ahead
+    :return: iterable list of the same items
+    """
+    queue = Queue(maxsize=depth)
+    stop = threading.Event()
+    # The items are fetched on behalf of this thread, stopped along with it
+    parent = getattr(_local, 'stop', None)
+
+    def run():
+        if parent is not None:
+            interruptible(parent)
+        try:
+            for item in items:
+                if not put(queue, (item, None), stop):
+                    return
+        except Exception as e:
+            put(queue, (None, e), stop)
+        put(queue, (_END, None), stop)
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while True:
+            item, error = queue.get()
+            if error is not None:
+                raise error
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
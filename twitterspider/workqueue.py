@@ -0,0 +1,337 @@
+import os
+import socket
+import sqlite3
+import threading
+from time import time, sleep
+from typing import Iterable
+
+from spiderutil.log import Log
+
+from .tweet import Tweet
+from .twitter import TwitterSpider
+
+LEASE = 600
+ATTEMPTS = 5
+POLL = 10
+TIMEOUT = 60
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class WorkQueue:
+    """
+    Queue of users to crawl shared by many worker processes, backed by a SQLite file.
+    Workers on different hosts could share the file on a network filesystem with working file locks.
+
+    Every user is leased to one worker at a time. A lease expires if the worker does not renew it,
+    e.g. the worker crashed, and the user is leased to another worker again.
+    A user failed too many times is given up.
+    The newest tweet id of every user is kept, so `reset` starts another round of incremental crawls.
+    """
+
+    def __init__(self, path: str = './queue.db', lease: float = LEASE, attempts: int = ATTEMPTS,
+                 timeout: float = TIMEOUT):
+        """
+        :param path: str, path of the SQLite file
+        :param lease: float, seconds a lease lasts without renewal
+        :param attempts: int, the limit of leases of a user before it is given up
+        :param timeout: float, seconds to wait for the lock of the file held by other workers
+        """
+        self.path = os.path.abspath(path)
+        self.lease_time = lease
+        self.attempts = attempts
+        self.timeout = timeout
+        # Transactions are begun explicitly, the rollback journal works on network filesystems unlike WAL
+        self.conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None)
+        self._execute('CREATE TABLE IF NOT EXISTS users ('
+                      'user_id INTEGER PRIMARY KEY, status TEXT, worker TEXT, expires REAL, attempts INTEGER, '
+                      'since_id INTEGER, count INTEGER, error TEXT, updated REAL)')
+        self._execute('CREATE INDEX IF NOT EXISTS users_status ON users (status, expires)')
+
+    def _execute(self, sql: str, params=()):
+        with self._transaction():
+            return self.conn.execute(sql, params).rowcount
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+    def add(self, user_ids: Iterable) -> int:
+        """
+        Add users to crawl, the users in the queue already are ignored.
+        :return: int, count of users added
+        """
+        # The ids may be crawled lazily, the write lock must not be held while waiting for the rate limit
+        user_ids = list(user_ids)
+        now = time()
+        with self._transaction():
+            return self.conn.executemany('INSERT OR IGNORE INTO users VALUES (?, ?, NULL, NULL, 0, NULL, 0, NULL, ?)',
+                                         [(user_id, PENDING, now) for user_id in user_ids]).rowcount
+
+    def populate(self, spider: TwitterSpider, screen_name: str = None, user_id: str = None) -> int:
+        """
+        Add all the users followed by specified user.
+        :return: int, count of users added
+        """
+        return self.add(spider.crawl_following_ids(screen_name=screen_name, user_id=user_id))
+
+    def lease(self, worker: str, count: int = 1) -> list:
+        """
+        Lease pending users, or users whose lease has expired, to the worker.
+        :param worker: str, the unique name of the worker
+        :param count: int, the limit of users leased
+        :return: list of user ids
+        """
+        now = time()
+        with self._transaction():
+            # Workers crashed on the user every time
+            self.conn.execute('UPDATE users SET status = ?, error = ?, updated = ? '
+                              'WHERE status = ? AND expires < ? AND attempts >= ?',
+                              (FAILED, 'Lease expired', now, LEASED, now, self.attempts))
+            user_ids = [row[0] for row in self.conn.execute(
+                'SELECT user_id FROM users WHERE (status = ? OR (status = ? AND expires < ?)) AND attempts < ? '
+                'ORDER BY attempts, user_id LIMIT ?', (PENDING, LEASED, now, self.attempts, count))]
+            self.conn.executemany('UPDATE users SET status = ?, worker = ?, expires = ?, attempts = attempts + 1, '
+                                  'updated = ? WHERE user_id = ?',
+                                  [(LEASED, worker, now + self.lease_time, now, user_id) for user_id in user_ids])
+        return user_ids
+
+    def renew(self, worker: str, user_id) -> bool:
+        """
+        Extend the lease of the user.
+        :return: bool, False if the lease is lost, e.g. it has expired and been leased to another worker
+        """
+        now = time()
+        return self._execute('UPDATE users SET expires = ?, updated = ? '
+                             'WHERE user_id = ? AND status = ? AND worker = ?',
+                             (now + self.lease_time, now, user_id, LEASED, worker)) > 0
+
+    def complete(self, worker: str, user_id, since_id=None, count: int = 0) -> bool:
+        """
+        Mark the user as crawled.
+        :param since_id: int, the newest tweet id crawled, an older id never overwrites a newer one
+        :param count: int, count of tweets crawled
+        :return: bool, False if the lease is lost
+        """
+        return self._execute('UPDATE users SET status = ?, expires = NULL, error = NULL, count = count + ?, '
+                             'since_id = MAX(IFNULL(since_id, 0), IFNULL(?, 0)), updated = ? '
+                             'WHERE user_id = ? AND status = ? AND worker = ?',
+                             (DONE, count, since_id, time(), user_id, LEASED, worker)) > 0
+
+    def fail(self, worker: str, user_id, error=None) -> bool:
+        """
+        Return the user to the queue, or give it up once it has been leased too many times.
+        :return: bool, False if the lease is lost
+        """
+        return self._execute('UPDATE users SET status = CASE WHEN attempts < ? THEN ? ELSE ? END, '
+                             'expires = NULL, error = ?, updated = ? WHERE user_id = ? AND status = ? AND worker = ?',
+                             (self.attempts, PENDING, FAILED, None if error is None else str(error), time(),
+                              user_id, LEASED, worker)) > 0
+
+    def release(self, worker: str, user_id) -> bool:
+        """
+        Return the user to the queue without counting an attempt, e.g. the worker is stopped.
+        :return: bool, False if the lease is lost
+        """
+        return self._execute('UPDATE users SET status = ?, expires = NULL, attempts = attempts - 1, updated = ? '
+                             'WHERE user_id = ? AND status = ? AND worker = ?',
+                             (PENDING, time(), user_id, LEASED, worker)) > 0
+
+    def since_id(self, user_id):
+        """
+        :return: the newest tweet id crawled of the user, or None if never crawled
+        """
+        row = self.conn.execute('SELECT since_id FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row is not None and row[0] else None
+
+    def reset(self, failed: bool = False) -> int:
+        """
+        Start another round, the users crawled are pending again and only their newer tweets are crawled.
+        :param failed: bool, retry the users given up too
+        :return: int, count of users reset
+        """
+        statuses = (DONE, FAILED) if failed else (DONE,)
+        return self._execute('UPDATE users SET status = ?, attempts = 0, worker = NULL, updated = ? '
+                             'WHERE status IN ({})'.format(','.join('?' * len(statuses))),
+                             (PENDING, time()) + statuses)
+
+    def active(self) -> int:
+        """
+        :return: int, count of users pending or leased, i.e. the queue is not drained
+        """
+        return self.conn.execute('SELECT COUNT(*) FROM users WHERE (status = ? OR status = ?) AND attempts < ?',
+                                 (PENDING, LEASED, self.attempts)).fetchone()[0]
+
+    def stats(self) -> dict:
+        """
+        :return: dict of status to the count of users
+        """
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM users GROUP BY status'))
+
+    def close(self):
+        self.conn.close()
+
+
+class _Transaction:
+    """
+    Take the write lock at the beginning, so concurrent workers never lease the same user.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.conn.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+
+
+class Worker:
+    """
+    Lease users from the queue and crawl their timelines until the queue is drained.
+
+        queue = WorkQueue('/shared/queue.db')
+        queue.populate(spider, screen_name='twitter')  # once, by any worker
+        for tweet in Worker(spider, queue).run():
+            ...
+
+    A user is completed once all its tweets have been consumed, a worker crashed in the middle
+    of a user leaves the lease to expire, then the user is crawled again from the former since id,
+    so a tweet may be yielded more than once.
+    The leases of the batch are renewed by a background thread, even while the crawl waits
+    for the rate limit or the consumer is slow.
+    """
+
+    def __init__(self, spider: TwitterSpider, queue: WorkQueue, name: str = None, batch: int = 1,
+                 poll: float = POLL, logger=None, **kwargs):
+        """
+        :param name: str, the unique name of the worker, default is the host name and the process id
+        :param batch: int, count of users leased at once
+        :param poll: float, seconds to wait for the leases of other workers to be completed or expire
+        :param kwargs: other parameters of `TwitterSpider.crawl_timeline`
+        """
+        self.spider = spider
+        self.queue = queue
+        self.name = name if name is not None else '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.batch = batch
+        self.poll = poll
+        self.kwargs = kwargs
+        self.logger = Log.create_logger('TwitterSpider', './twitter.log') if logger is None else logger
+
+    def run(self) -> Iterable[Tweet]:
+        """
+        :return: iterable list of tweet objects
+        """
+        while True:
+            leased = time()
+            user_ids = self.queue.lease(self.name, self.batch)
+            if len(user_ids) <= 0:
+                # Users leased by other workers may be returned if they fail or crash
+                if self.queue.active() <= 0:
+                    return
+                sleep(self.poll)
+                continue
+            heartbeat = _Heartbeat(self.queue, self.name, user_ids, leased, self.logger)
+            heartbeat.start()
+            try:
+                for i, user_id in enumerate(user_ids):
+                    try:
+                        for tweet in self._crawl(user_id, heartbeat):
+                            yield tweet
+                    except GeneratorExit:
+                        # The users of the batch not crawled yet are left to other workers too
+                        for rest in user_ids[i + 1:]:
+                            self.queue.release(self.name, rest)
+                        raise
+                    heartbeat.discard(user_id)
+            finally:
+                heartbeat.stop()
+
+    def _crawl(self, user_id, heartbeat) -> Iterable[Tweet]:
+        self.logger.info('Worker %s leased user %s.', self.name, user_id)
+        newest, count = None, 0
+        try:
+            for tweet in self.spider.crawl_timeline(user_id=user_id, since_id=self.queue.since_id(user_id),
+                                                    **self.kwargs):
+                if user_id in heartbeat.lost:
+                    self.logger.warning('Worker %s lost the lease of user %s.', self.name, user_id)
+                    return
+                if newest is None or tweet.id > newest:
+                    newest = tweet.id
+                count += 1
+                yield tweet
+        except GeneratorExit:
+            # The consumer stopped, leave the user to other workers
+            self.queue.release(self.name, user_id)
+            raise
+        except Exception as e:
+            self.logger.error('Worker %s failed to crawl user %s: %s', self.name, user_id, e)
+            self.queue.fail(self.name, user_id, e)
+            return
+        if not self.queue.complete(self.name, user_id, since_id=newest, count=count):
+            self.logger.warning('Worker %s lost the lease of user %s.', self.name, user_id)
+
+
+class _Heartbeat(threading.Thread):
+    """
+    Renew the leases of a batch every third of the lease time, with its own connection of the queue.
+    A lease is lost if it has been leased to another worker, or it could not be renewed before it expired.
+    """
+
+    def __init__(self, queue: WorkQueue, worker: str, user_ids: list, leased: float, logger):
+        """
+        :param leased: float, the time no later than the users were leased
+        """
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.worker = worker
+        self.logger = logger
+        self.user_ids = set(user_ids)
+        # A lease lasts from its last renewal, it is given up once it may have expired
+        self.expires = dict.fromkeys(user_ids, leased + queue.lease_time)
+        self.lost = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def run(self):
+        queue = None
+        try:
+            while not self.stopped.wait(self.queue.lease_time / 3):
+                with self.lock:
+                    user_ids = list(self.user_ids)
+                for user_id in user_ids:
+                    try:
+                        if queue is None:
+                            queue = WorkQueue(self.queue.path, lease=self.queue.lease_time,
+                                              attempts=self.queue.attempts, timeout=self.queue.timeout)
+                        now = time()
+                        renewed = queue.renew(self.worker, user_id)
+                    except sqlite3.Error as e:
+                        # e.g. the file is locked by other workers for longer than the timeout, retry on the next beat
+                        self.logger.warning('Worker %s failed to renew the lease of user %s: %s',
+                                            self.worker, user_id, e)
+                        renewed = time() < self.expires[user_id]
+                    else:
+                        if renewed:
+                            self.expires[user_id] = now + self.queue.lease_time
+                    if not renewed:
+                        with self.lock:
+                            self.user_ids.discard(user_id)
+                            self.lost.add(user_id)
+        finally:
+            if queue is not None:
+                queue.close()
+
+    def discard(self, user_id):
+        """
+        Stop renewing the lease of the user, e.g. it is completed.
+        """
+        with self.lock:
+            self.user_ids.discard(user_id)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()